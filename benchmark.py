@@ -0,0 +1,206 @@
+import argparse
+import concurrent.futures as cf
+import itertools
+import json
+import pathlib
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import cluster as cl
+import dumpSameImages as dsi
+
+EXTENSIONS = [".jpg", ".png", ".webp"]
+SIZES = [(480, 640), (640, 480), (600, 600), (400, 800)]
+MANIFEST = "corpus.json"
+
+
+def makeSource(rng):
+  height, width = SIZES[rng.integers(len(SIZES))]
+  y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+  angle = rng.uniform(0, 2 * np.pi)
+  gradient = np.cos(angle) * x / width + np.sin(angle) * y / height
+  base = np.stack([gradient * rng.uniform(50, 200) + rng.uniform(0, 55) for _ in range(3)], axis=-1)
+  blobs = cv2.resize(rng.normal(0, 40, (8, 8, 3)).astype(np.float32), (width, height), interpolation=cv2.INTER_CUBIC)
+  detail = rng.normal(0, 8, (height, width, 3))
+  return np.clip(base + blobs + detail, 0, 255).astype(np.uint8)
+
+
+def getVariants(image):
+  height, width = image.shape[:2]
+  dy, dx = height // 20, width // 20
+  py, px = height // 25, width // 25
+  shifted = np.clip(image.astype(np.int16) + np.array([12, -8, 5], dtype=np.int16), 0, 255).astype(np.uint8)
+  return {
+    "orig": (".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95]),
+    "resize": (".jpg", cv2.resize(image, (width // 2, height // 2), interpolation=cv2.INTER_AREA), []),
+    "q70": (".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70]),
+    "q40": (".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 40]),
+    "crop": (".jpg", image[dy:-dy, dx:-dx], []),
+    "png": (".png", image, []),
+    "webp": (".webp", image, [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    "color": (".jpg", shifted, []),
+    "pad": (".jpg", cv2.copyMakeBorder(image, py, py, px, px, cv2.BORDER_CONSTANT, value=(0, 0, 0)), []),
+  }
+
+
+def generateCorpus(root, countSource, seed):
+  rng = np.random.default_rng(seed)
+  root.mkdir(parents=True, exist_ok=True)
+  count = 0
+  for i in range(countSource):
+    directory = pathlib.Path(root, f"d{i % 8}")
+    directory.mkdir(exist_ok=True)
+    for name, (suffix, image, params) in getVariants(makeSource(rng)).items():
+      cv2.imwrite(str(pathlib.Path(directory, f"src{i:05}_{name}{suffix}")), image, params)
+      count += 1
+  with pathlib.Path(root, MANIFEST).open("w", encoding="utf_8") as file:
+    json.dump({"countSource": countSource, "seed": seed, "images": count}, file, indent=2)
+  return count
+
+
+# 生成時のパラメーター。自前で生成していないコーパスはNoneを返す
+def loadManifest(root):
+  try:
+    with pathlib.Path(root, MANIFEST).open(encoding="utf_8") as file:
+      return json.load(file)
+  except (OSError, ValueError):
+    return None
+
+
+def getSource(path):
+  return path.name.split("_", 1)[0]
+
+
+def getPairs(groups):
+  return {tuple(sorted(pair)) for group in groups for pair in itertools.combinations(group, 2)}
+
+
+def getTruePairs(paths):
+  sources = {}
+  for path in paths:
+    sources.setdefault(getSource(path), []).append(str(path))
+  return getPairs(sources.values())
+
+
+def getPeakRss():
+  try:
+    import resource  # noqa: PLC0415
+  except ImportError:
+    try:
+      import psutil  # noqa: PLC0415
+    except ImportError:
+      return None
+    return psutil.Process().memory_info().peak_wset / 2**20
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def getEdges(method, targets, threshold, matcher, ex, fails, cascadeMethod):
+  match method:
+    case "pHash":
+      return dsi.getEdgesPHash(targets, targets, threshold)
+    case "cascade":
+      _, detector, cascadeMatcher = dsi.getDetector(cascadeMethod)
+      return dsi.getEdgesCascade(targets, targets, threshold, 12.0, detector, cascadeMatcher, ex, fails)
+  return dsi.getEdgesDescriptor(targets, targets, threshold, matcher)
+
+
+def runMethod(method, root, isReduced=False, cascadeMethod="AKAZE(MLDB)"):
+  threshold = dsi.setThreshold(cascadeMethod if method == "cascade" else method)
+  times = {}
+  start = time.perf_counter()
+  targets, _, _ = dsi.getFiles(root, None, EXTENSIONS)
+  times["walk"] = time.perf_counter() - start
+  count = len(targets)
+  paths = [data["path"] for data in targets]
+  _, detector, matcher = dsi.getDetector(method)
+  fails = []
+  with cf.ThreadPoolExecutor() as ex:
+    start = time.perf_counter()
+    dsi.setInfoAll(targets, ex, fails, detector, isReduced=isReduced)
+    times["extract"] = time.perf_counter() - start
+    start = time.perf_counter()
+    edges = list(getEdges(method, targets, threshold, matcher, ex, fails, cascadeMethod))
+    groups = cl.greedy(len(targets), len(targets), edges, isSelf=True)
+    times["compare"] = time.perf_counter() - start
+  predicted = getPairs([[str(targets[i]["path"]) for i, _ in group] for group in groups])
+  truth = getTruePairs(paths)
+  hit = len(predicted & truth)
+  precision = hit / len(predicted) if len(predicted) > 0 else 1.0
+  recall = hit / len(truth) if len(truth) > 0 else 1.0
+  return {
+    "method": method,
+    "threshold": threshold,
+    "images": count,
+    "fails": len(fails),
+    "groups": len(groups),
+    "seconds": times,
+    "imagesPerSecond": {k: count / v if v > 0 else None for k, v in times.items()},
+    "peakRssMiB": getPeakRss(),
+    "precision": precision,
+    "recall": recall,
+    "f1": 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0,
+  }
+
+
+def getCommit():
+  try:
+    result = subprocess.run(
+      ["git", "rev-parse", "HEAD"],  # noqa: S607
+      cwd=pathlib.Path(__file__).parent,
+      capture_output=True,
+      text=True,
+      check=True,
+    )
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return result.stdout.strip()
+
+
+def argumentParser():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("corpusPath", type=pathlib.Path)
+  parser.add_argument("-o", "--outputPath", type=pathlib.Path, default=None)
+  parser.add_argument("-n", "--countSource", type=int, default=50)
+  parser.add_argument("-s", "--seed", type=int, default=0)
+  parser.add_argument("-m", "--methods", nargs="*", default=["pHash", "ORB", "AKAZE(MLDB)", "cascade"])
+  parser.add_argument("-r", "--reduced", action="store_true")
+  args = parser.parse_args()
+  corpusPath = args.corpusPath.absolute()
+  outputPath = pathlib.Path(corpusPath, "benchmark.json") if args.outputPath is None else args.outputPath
+  return corpusPath, outputPath, args.countSource, args.seed, args.methods, args.reduced
+
+
+if __name__ == "__main__":
+  corpusPath, outputPath, countSource, seed, methods, isReduced = argumentParser()
+  if not corpusPath.exists():
+    print(f"generated: {generateCorpus(corpusPath, countSource, seed)} images")
+  manifest = loadManifest(corpusPath)
+  if manifest is None:
+    print("corpus was not generated by this script, so countSource and seed are not recorded")
+  elif (manifest["countSource"], manifest["seed"]) != (countSource, seed):
+    print(f"reusing corpus built with countSource {manifest['countSource']}, seed {manifest['seed']}")
+  results = []
+  for method in methods:
+    # peakRssをメソッドごとに測るため別プロセスで実行する
+    with cf.ProcessPoolExecutor(max_workers=1) as pex:
+      result = pex.submit(runMethod, method, corpusPath, isReduced).result()
+    print(
+      f"\r\x1b[1M{method:12}: precision {result['precision']:.3f}, recall {result['recall']:.3f}, "
+      f"{result['imagesPerSecond']['extract']:10.2f} images/s (extract), "
+      f"{result['seconds']['compare']:10.3f}s (compare), {result['peakRssMiB']} MiB",
+    )
+    results.append(result)
+  report = {
+    "commit": getCommit(),
+    "corpus": {"path": str(corpusPath), **(manifest or {"countSource": None, "seed": None})},
+    "isReduced": isReduced,
+    "results": results,
+  }
+  with outputPath.open("w", encoding="utf_8") as file:
+    json.dump(report, file, indent=2)
+  print(f'output: "{outputPath}"')
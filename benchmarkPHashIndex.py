@@ -0,0 +1,60 @@
+import argparse
+import time
+
+import numpy as np
+
+import phashIndex as phi
+
+
+def makeHashes(count, countCluster, maxFlip, seed):
+  rng = np.random.default_rng(seed)
+  hashes = rng.integers(0, np.iinfo(np.uint64).max, size=count, dtype=np.uint64, endpoint=True)
+  sources = rng.integers(0, count, size=countCluster)
+  for i in sources:
+    j = rng.integers(0, count)
+    flips = rng.choice(64, size=rng.integers(0, maxFlip + 1), replace=False)
+    flip = np.uint64(sum(1 << int(b) for b in flips))
+    hashes[j] = hashes[i] ^ flip
+  return hashes
+
+
+def benchmark(name, hashes, queries, threshold):
+  start = time.perf_counter()
+  index = phi.createIndex(name, hashes, threshold)
+  build = time.perf_counter() - start
+  start = time.perf_counter()
+  results = [index.query(x)[0] for x in queries]
+  query = time.perf_counter() - start
+  return build, query, results
+
+
+def argumentParser():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-n", "--count", type=int, default=100000)
+  parser.add_argument("-q", "--queries", type=int, default=1000)
+  parser.add_argument("-th", "--threshold", type=float, default=4.0)
+  parser.add_argument("-s", "--seed", type=int, default=0)
+  parser.add_argument("-i", "--indices", nargs="*", choices=phi.getIndexNames(), default=phi.getIndexNames())
+  args = parser.parse_args()
+  return args.count, args.queries, args.threshold, args.seed, args.indices
+
+
+if __name__ == "__main__":
+  count, countQuery, threshold, seed, names = argumentParser()
+  hashes = makeHashes(count, count // 10, int(threshold), seed)
+  queries = hashes[np.random.default_rng(seed + 1).integers(0, count, size=countQuery)]
+  print(f"hashes: {count}, queries: {countQuery}, threshold: {threshold}")
+  expected = None
+  for name in ["linear", *[x for x in names if x != "linear"]]:
+    build, query, results = benchmark(name, hashes, queries, threshold)
+    if expected is None:
+      expected = results
+      speedup = 1.0
+      base = query
+    else:
+      speedup = base / query if query > 0 else float("inf")
+    same = all(np.array_equal(np.sort(a), np.sort(b)) for a, b in zip(results, expected, strict=True))
+    print(
+      f"{name:8}: build {build:10.6f}s, query {query:10.6f}s ({query / countQuery * 1e6:10.2f}us/query), "
+      f"x{speedup:7.2f}, same: {same}",
+    )
@@ -0,0 +1,81 @@
+import collections
+import contextlib
+import os
+import pathlib
+import pickle
+import time
+
+
+# 比較済みのtarget、出力済みのグループ、失敗したファイルを定期的に保存する
+# 再開時は出力をグループから書き直すので、途中で壊れた出力ファイルは使わない
+class Checkpoint:
+  def __init__(self, path, key, interval=300.0):
+    self.path = pathlib.Path(path)
+    self.key = key
+    self.interval = interval
+    self.processed = []
+    self.groups = []
+    self.fails = []
+    self.last = time.monotonic()
+
+  def load(self):
+    if not self.path.exists():
+      return False
+    with self.path.open("rb") as file:
+      state = pickle.load(file)  # noqa: S301
+    if state["key"] != self.key:
+      msg = f'"{self.path}" was made with different arguments: {state["key"]}'
+      raise ValueError(msg)
+    self.processed = state["processed"]
+    self.groups = state["groups"]
+    self.fails = state["fails"]
+    return True
+
+  def getConsumed(self):
+    consumed = set(self.processed) | set(self.fails)
+    consumed.update(data["path"] for group in self.groups for data in group)
+    return consumed
+
+  def countSames(self, dirs):
+    counts = collections.Counter(data["path"].parent for group in self.groups for data in group)
+    for parent, count in counts.items():
+      if parent in dirs:
+        dirs[parent]["sames"] += count
+
+  def addTarget(self, target):
+    self.processed.append(target["path"])
+
+  def addGroup(self, sames):
+    self.groups.append(sames)
+
+  def isDue(self):
+    return time.monotonic() - self.last >= self.interval
+
+  # failsは呼び出し側と同じリストを共有する
+  def save(self):
+    state = {"key": self.key, "processed": self.processed, "groups": self.groups, "fails": list(self.fails)}
+    temp = self.path.with_name(f"{self.path.name}.tmp")
+    with temp.open("wb") as file:
+      pickle.dump(state, file)
+      file.flush()
+      os.fsync(file.fileno())
+    temp.replace(self.path)
+    self.last = time.monotonic()
+
+  def saveIfDue(self):
+    if self.isDue():
+      self.save()
+
+  def remove(self):
+    self.path.unlink(missing_ok=True)
+
+
+# Ctrl-Cなどで止まったときにも最後の状態を残す
+@contextlib.contextmanager
+def saveOnError(checkpoint):
+  try:
+    yield
+  except BaseException:
+    if checkpoint is not None:
+      checkpoint.save()
+    raise
@@ -0,0 +1,130 @@
+class UnionFind:
+  def __init__(self, count):
+    self.parents = list(range(count))
+    self.sizes = [1] * count
+
+  def find(self, x):
+    parents = self.parents
+    while parents[x] != x:
+      parents[x] = parents[parents[x]]
+      x = parents[x]
+    return x
+
+  def union(self, a, b):
+    a = self.find(a)
+    b = self.find(b)
+    if a == b:
+      return a
+    if self.sizes[a] < self.sizes[b]:
+      a, b = b, a
+    self.parents[b] = a
+    self.sizes[a] += self.sizes[b]
+    return a
+
+  def getComponents(self):
+    components = {}
+    for x in range(len(self.parents)):
+      components.setdefault(self.find(x), []).append(x)
+    return [nodes for nodes in components.values() if len(nodes) > 1]
+
+
+def getNeighbors(edges):
+  neighbors = {}
+  for a, b, diff in edges:
+    neighbors.setdefault(a, {})[b] = diff
+    neighbors.setdefault(b, {})[a] = diff
+  return neighbors
+
+
+# 次数が最大、同数なら差の合計が最小のものを中心にする
+def getMedoid(nodes, neighbors):
+  members = set(nodes)
+
+  def key(x):
+    adjacent = [d for y, d in neighbors.get(x, {}).items() if y in members]
+    return (-len(adjacent), sum(adjacent), x)
+
+  return min(nodes, key=key)
+
+
+def toGroup(center, members, neighbors):
+  group = [(center, None)]
+  for x in sorted(members, key=lambda y: (neighbors[center].get(y, float("inf")), y)):
+    if x == center:
+      continue
+    diff = neighbors[center].get(x)
+    if diff is None:
+      diff = min(d for y, d in neighbors[x].items() if y in members)
+    group.append((x, diff))
+  return group
+
+
+def splitStar(nodes, neighbors):
+  result = []
+  remains = set(nodes)
+  while len(remains) > 1:
+    center = getMedoid(sorted(remains), neighbors)
+    members = {x for x in neighbors[center] if x in remains} | {center}
+    remains -= members
+    if len(members) > 1:
+      result.append(toGroup(center, members, neighbors))
+    else:
+      break
+  return result
+
+
+def splitComplete(nodes, neighbors):
+  result = []
+  remains = set(nodes)
+  while len(remains) > 1:
+    center = getMedoid(sorted(remains), neighbors)
+    members = {center}
+    for x in sorted((y for y in neighbors[center] if y in remains), key=lambda y: (neighbors[center][y], y)):
+      if all(y in neighbors[x] for y in members):
+        members.add(x)
+    remains -= members
+    if len(members) > 1:
+      result.append(toGroup(center, members, neighbors))
+    else:
+      break
+  return result
+
+
+def cluster(count, edges, linkage="single"):
+  edges = list(edges)
+  uf = UnionFind(count)
+  for a, b, _ in edges:
+    uf.union(a, b)
+  neighbors = getNeighbors(edges)
+  result = []
+  for nodes in uf.getComponents():
+    match linkage:
+      case "single":
+        result.append(toGroup(getMedoid(nodes, neighbors), set(nodes), neighbors))
+      case "star":
+        result.extend(splitStar(nodes, neighbors))
+      case "complete":
+        result.extend(splitComplete(nodes, neighbors))
+  return result
+
+
+# 元の逐次処理と同じく、後ろのtargetから順に残っている隣接ノードをまとめる
+def greedy(countTarget, count, edges, isSelf):
+  neighbors = getNeighbors(edges)
+  alive = [True] * count
+  result = []
+  for i in reversed(range(countTarget)):
+    if isSelf:
+      if not alive[i]:
+        continue
+      alive[i] = False
+    members = [(j, d) for j, d in sorted(neighbors.get(i, {}).items()) if alive[j] and (isSelf or j >= countTarget)]
+    for j, _ in members:
+      alive[j] = False
+    if len(members) > 0:
+      result.append([(i, None), *members])
+  return result
+
+
+def getLinkageNames():
+  return ["single", "complete", "star"]
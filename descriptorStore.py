@@ -0,0 +1,54 @@
+import pathlib
+import threading
+
+import numpy as np
+
+SEGMENT_SIZE = 2**26
+ALIGNMENT = 64
+
+
+# 記述子をメモリマップしたファイルに追記し、配列の代わりにそのビューを返す
+# ページはファイルに裏付けられるので、枚数が増えても常駐メモリは増えない
+class DescriptorStore:
+  def __init__(self, directory, segmentSize=SEGMENT_SIZE):
+    self.directory = pathlib.Path(directory)
+    self.segmentSize = segmentSize
+    self.lock = threading.Lock()
+    self.segments = []
+    self.used = 0
+    self.countByte = 0
+    self.offsets = []
+
+  def newSegment(self, size):
+    path = pathlib.Path(self.directory, f"descriptors_{id(self)}_{len(self.segments)}.bin")
+    self.segments.append(np.memmap(path, dtype=np.uint8, mode="w+", shape=(max(size, self.segmentSize),)))
+    self.used = 0
+
+  def add(self, descriptors):
+    size = -(-descriptors.nbytes // ALIGNMENT) * ALIGNMENT
+    with self.lock:
+      if len(self.segments) == 0 or self.used + size > len(self.segments[-1]):
+        self.newSegment(size)
+      self.offsets.append((len(self.segments) - 1, self.used, descriptors.dtype, descriptors.shape))
+      self.used += size
+      self.countByte += descriptors.nbytes
+      i = len(self.offsets) - 1
+    view = self[i]
+    view[...] = descriptors
+    return view
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def __getitem__(self, i):
+    segment, start, dtype, shape = self.offsets[i]
+    return self.segments[segment][start : start + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+
+  def nbytes(self):
+    return self.countByte
+
+  # ビューが残っていてもマップは参照が消えるまで有効
+  def close(self):
+    for segment in self.segments:
+      segment.flush()
+    self.segments = []
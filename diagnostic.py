@@ -0,0 +1,56 @@
+import csv
+import json
+import pathlib
+
+import numpy as np
+
+NO_PAIR = 2**15 - 1
+
+
+# 候補(diffs, indices)を既存のtopKと合わせて、行ごとに小さい順にk個だけ残す
+def updateTopK(bestDiffs, bestIndices, diffs, indices, k):
+  diffs = np.concatenate([bestDiffs, diffs], axis=1)
+  indices = np.concatenate([bestIndices, indices], axis=1)
+  if diffs.shape[1] > k:
+    part = np.argpartition(diffs, k - 1, axis=1)[:, :k]
+    diffs = np.take_along_axis(diffs, part, axis=1)
+    indices = np.take_along_axis(indices, part, axis=1)
+  order = np.lexsort((indices, diffs), axis=1)
+  return np.take_along_axis(diffs, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class PairWriter:
+  def __init__(self, path):
+    self.path = pathlib.Path(path)
+    self.isCsv = self.path.suffix.lower() == ".csv"
+    self.file = None
+    self.writer = None
+
+  def __enter__(self):
+    self.file = self.path.open("w", encoding="utf_8", newline="")
+    if self.isCsv:
+      self.writer = csv.writer(self.file)
+      self.writer.writerow(["target", "other", "rank", "diff", "ratioDiff"])
+    return self
+
+  def __exit__(self, *args):
+    self.file.close()
+
+  def writePair(self, target, other, rank, diff, ratioDiff):
+    if self.isCsv:
+      self.writer.writerow([target, other, rank, diff, f"{ratioDiff:.4f}"])
+    else:
+      record = {"type": "pair", "target": str(target), "other": str(other), "rank": rank, "diff": diff}
+      record["ratioDiff"] = round(ratioDiff, 4)
+      self.file.write(json.dumps(record) + "\n")
+
+  # CSVはペアと列が違うので、ヒストグラムは別ファイルに書く
+  def writeHistogram(self, histogram, nearHistogram):
+    if self.isCsv:
+      with self.path.with_name(f"{self.path.stem}_histogram.csv").open("w", encoding="utf_8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["diff", "count", "countNearRatio"])
+        writer.writerows(zip(range(len(histogram)), histogram.tolist(), nearHistogram.tolist(), strict=True))
+    else:
+      record = {"type": "histogram", "counts": histogram.tolist(), "countsNearRatio": nearHistogram.tolist()}
+      self.file.write(json.dumps(record) + "\n")
@@ -1,18 +1,38 @@
 import argparse
+import collections
 import concurrent.futures as cf
+import contextlib
 import functools
+import os
 import pathlib
 import pickle
 import sys
-import threading
+import tempfile
 import time
 
 import cv2
 import Decorator as D
 import ImageUtility as IU
+import numpy as np
 import TimeUtility as TU
 
+import checkpoint as cp
+import cluster as cl
+import descriptorStore as ds
+import diagnostic as dg
+import exactDuplicate as ed
+import featureCache as fc
+import globalDescriptor as gd
+import groupFile as gf
+import groupWriter as gw
+import incremental as inc
+import multiHash as mh
+import phashIndex as phi
+import pipeline as pl
+import profiler as pf
 import readSameImagePickle as rsip
+import thumbnailCache as tn
+import tiledCompare as tc
 import Utility as U
 import utility as u
 
@@ -23,8 +43,10 @@ def getFiles(path, targetPath, extensions=None):
   if targetPath is not None:
     targets, targetDirs = u.getFiles(targetPath, isRecurse=True, extensions=extensions)
     others, otherDirs = u.getFiles(path, isRecurse=True, extensions=extensions)
-    targets = U.subList(targets, others)
-    others = U.subList(others, targets)
+    otherPaths = {data["path"] for data in others}
+    targets = [data for data in targets if data["path"] not in otherPaths]
+    targetPaths = {data["path"] for data in targets}
+    others = [data for data in others if data["path"] not in targetPaths]
     dirs = targetDirs | otherDirs
   else:
     targets, dirs = u.getFiles(path, isRecurse=True, extensions=extensions)
@@ -32,51 +54,498 @@ def getFiles(path, targetPath, extensions=None):
   return targets, others, dirs
 
 
-def setInfo(data, detector):
-  image = IU.readImage(data["path"])
+FEATURE_KEYS = ["descriptors", "pHash", "hashes"]
+progress = pf.ProgressPrinter()
+
+
+# 特徴点が多すぎる画像はresponseの大きい順にmaxKeyPoint個だけ記述子を計算する
+def detect(detector, image, maxKeyPoint=None, isHalf=False):
+  if maxKeyPoint is None:
+    _keyPoints, descriptors = detector.detectAndCompute(image, None)
+  else:
+    keyPoints = detector.detect(image, None)
+    if len(keyPoints) > maxKeyPoint:
+      keyPoints = sorted(keyPoints, key=lambda x: x.response, reverse=True)[:maxKeyPoint]
+    _keyPoints, descriptors = detector.compute(image, keyPoints)
+  if isHalf and descriptors is not None and descriptors.dtype == np.float32:
+    descriptors = descriptors.astype(np.float16)
+  return descriptors
+
+
+# IU.readImageは読み込みとデコードを分けられないので、
+# decodeにはファイルの読み込みも含まれる
+def setInfo(
+  data,
+  detector,
+  *,
+  isReduced=False,
+  maxKeyPoint=None,
+  isHalf=False,
+  store=None,
+  hashNames=(),
+  thumbnailCache=None,
+  thumbnailBox=None,
+):
+  pf.count("files")
+  if "size" in data:
+    pf.count("bytes", data["size"])
+  with pf.timer("decode"):
+    if isReduced and detector is None:
+      image, shape = u.readReducedImage(data["path"])
+    else:
+      image = IU.readImage(data["path"])
+      shape = None if image is None else image.shape
   if image is None:
     return False, data
-  data["shape"] = image.shape
-  data["pHash"] = cv2.img_hash.pHash(image)
+  data["shape"] = shape
+  if thumbnailCache is not None:
+    with pf.timer("thumbnail"):
+      thumbnailCache.putFile(data["path"], thumbnailBox)
+  with pf.timer("hash"):
+    data["pHash"] = cv2.img_hash.pHash(image)
+    if len(hashNames) > 0:
+      data["hashes"] = mh.compute(image, hashNames)
   if detector is not None:
-    _keyPoints, descriptors = detector.detectAndCompute(image, None)
+    with pf.timer("detect"):
+      descriptors = detect(detector, image, maxKeyPoint, isHalf)
     if descriptors is None:
       return False, data
-    data["descriptors"] = descriptors
+    data["descriptors"] = descriptors if store is None else store.add(descriptors)
+  return True, data
+
+
+workerDetector = None
+workerOptions = {}
+
+
+def initWorker(
+  method,
+  isReduced=False,
+  maxKeyPoint=None,
+  isHalf=False,
+  hashNames=(),
+  profilePath=None,
+  isCProfile=False,
+  thumbnailDirectory=tn.DEFAULT_DIRECTORY,
+  thumbnailBox=None,
+  thumbnailCacheBytes=2**30,
+):
+  global workerDetector  # noqa: PLW0603
+  _, workerDetector, _ = getDetector(method)
+  workerOptions.update(isReduced=isReduced, maxKeyPoint=maxKeyPoint, isHalf=isHalf, hashNames=hashNames)
+  if thumbnailBox is not None:
+    thumbnailCache = tn.ThumbnailCache(thumbnailDirectory, thumbnailCacheBytes, memoryBytes=0)
+    workerOptions.update(thumbnailCache=thumbnailCache, thumbnailBox=thumbnailBox)
+  if profilePath is not None:
+    pf.configure(profilePath, isCProfile=isCProfile).startCProfile("worker")
+    pf.current.writeAtExit()
+
+
+def setInfoChunk(chunkId, paths, scratchDir):
+  results = [setInfo({"path": path}, workerDetector, **workerOptions) for path in paths]
+  successes = [success for success, _ in results]
+  datas = [data for success, data in results if success]
+  name = pathlib.Path(scratchDir, f"{chunkId}")
+  hashes = np.vstack([data["pHash"] for data in datas]) if len(datas) > 0 else np.empty((0, 8), np.uint8)
+  np.save(f"{name}_pHash.npy", hashes)
+  np.save(f"{name}_shape.npy", u.packShapes(datas))
+  for hashName in workerOptions["hashNames"] if len(datas) > 0 else []:
+    np.save(f"{name}_{hashName}.npy", np.vstack([data["hashes"][hashName] for data in datas]))
+  if workerDetector is not None and len(datas) > 0:
+    offsets = np.cumsum([0, *[len(data["descriptors"]) for data in datas]])
+    np.save(f"{name}_offset.npy", offsets)
+    np.save(f"{name}_descriptors.npy", np.concatenate([data["descriptors"] for data in datas]))
+  return chunkId, successes
+
+
+def loadChunk(name, datas, hasDescriptors, hashNames=()):
+  if len(datas) == 0:
+    return
+  hashes = np.load(f"{name}_pHash.npy")
+  shapes = np.load(f"{name}_shape.npy")
+  extras = {hashName: np.load(f"{name}_{hashName}.npy") for hashName in hashNames}
+  if hasDescriptors:
+    offsets = np.load(f"{name}_offset.npy")
+    descriptors = np.load(f"{name}_descriptors.npy", mmap_mode="c")
+  for i, data in enumerate(datas):
+    data["pHash"] = hashes[i : i + 1]
+    data["shape"] = u.unpackShape(shapes[i])
+    if len(extras) > 0:
+      data["hashes"] = {hashName: v[i : i + 1] for hashName, v in extras.items()}
+    if hasDescriptors:
+      data["descriptors"] = descriptors[offsets[i] : offsets[i + 1]]
+
+
+def setInfoProcess(lt, pex, scratchDir, hasDescriptors, chunkSize=64, hashNames=()):
+  futures = {}
+  for i in range(0, len(lt), chunkSize):
+    chunk = lt[i : i + chunkSize]
+    futures[pex.submit(setInfoChunk, f"{id(lt)}_{i}", [data["path"] for data in chunk], scratchDir)] = chunk
+  for future in cf.as_completed(futures):
+    chunkId, successes = future.result()
+    chunk = futures[future]
+    successDatas = [data for data, ok in zip(chunk, successes, strict=True) if ok]
+    loadChunk(pathlib.Path(scratchDir, chunkId), successDatas, hasDescriptors, hashNames)
+    for data, success in zip(chunk, successes, strict=True):
+      yield success, data
+
+
+def setDescriptors(data, detector, maxKeyPoint=None, isHalf=False, store=None):
+  with pf.timer("decode"):
+    image = IU.readImage(data["path"])
+  if image is None:
+    return False, data
+  with pf.timer("detect"):
+    descriptors = detect(detector, image, maxKeyPoint, isHalf)
+  if descriptors is None:
+    return False, data
+  data["descriptors"] = descriptors if store is None else store.add(descriptors)
   return True, data
 
 
-def setInfoAll(lt, ex, fails, detector):
-  func = functools.partial(setInfo, detector=detector)
-  rs = ex.map(func, lt)
+def setInfoAll(
+  lt,
+  ex,
+  fails,
+  detector,
+  cache=None,
+  pex=None,
+  scratchDir=None,
+  chunkSize=64,
+  *,
+  isReduced=False,
+  maxKeyPoint=None,
+  isHalf=False,
+  store=None,
+  hashNames=(),
+  thumbnailCache=None,
+  thumbnailBox=None,
+):
+  misses = lt
+  if cache is not None:
+    list(ex.map(fc.statFile, lt))
+    # ヒットした記述子はすぐにstoreへ移し、ヒープに溜めない
+    misses = []
+    for data in lt:
+      if not cache.get(data):
+        misses.append(data)
+      elif store is not None and "descriptors" in data:
+        data["descriptors"] = store.add(data["descriptors"])
+  if pex is None:
+    options = {
+      "isReduced": isReduced,
+      "maxKeyPoint": maxKeyPoint,
+      "isHalf": isHalf,
+      "store": store,
+      "hashNames": hashNames,
+      "thumbnailCache": thumbnailCache,
+      "thumbnailBox": thumbnailBox,
+    }
+    rs = ex.map(functools.partial(setInfo, detector=detector, **options), misses)
+  else:
+    rs = setInfoProcess(misses, pex, scratchDir, detector is not None, chunkSize, hashNames)
+  failed = set()
   for result in rs:
     success, data = result
     if not success:
       fails.append(data["path"])
-      lt.remove(data)
+      failed.add(id(data))
+      pf.count("fails")
+    elif cache is not None:
+      cache.put(data)
+  if len(failed) > 0:
+    lt[:] = [data for data in lt if id(data) not in failed]
+  if cache is not None:
+    cache.commit()
+
+
+# バイト列が同一のファイルは代表の1枚だけをデコードと比較に回す
+# 代表のパスからグループ(先頭が代表)を引けるようにして返す
+# targetPathがあるときは、一致する相手が同じになるようにtargetsとothersを別々にまとめる
+def removeExactDuplicates(targets, others, countReader=4):
+  isSelf = targets is others
+  groups = ed.findGroups(targets, countReader)
+  if not isSelf:
+    groups += ed.findGroups(others, countReader)
+  for group in groups:
+    group.sort(key=lambda data: data["path"])
+  removed = {id(data) for group in groups for data in group[1:]}
+  if len(removed) > 0:
+    targets[:] = [data for data in targets if id(data) not in removed]
+    if not isSelf:
+      others[:] = [data for data in others if id(data) not in removed]
+  pf.count("exactRemoved", len(removed))
+  print(f"exact: {len(groups)} groups, {len(removed)} files skipped")
+  return {group[0]["path"]: group for group in groups}
+
+
+# 比較で決まったグループに、代表と完全一致のファイルを差分0で加える
+# 代表自身はグループを作った側で数えるので、ここでは加えた分だけ数える
+# targetPathがあるときは、代表が何とも一致しなかったtargetだけのグループは作らない
+def attachCopies(sames, exactGroups, dirs, *, isSelf=True):
+  if not exactGroups or (len(sames) == 1 and not isSelf):
+    return
+  for data in sames[:]:
+    group = exactGroups.pop(data["path"], None)
+    for copy in group[1:] if group is not None else []:
+      copy["shape"] = data["shape"]
+      copy["diff"] = 0.0
+      sames.append(copy)
+      dirs[copy["path"].parent]["sames"] += 1
 
 
-def dump(pm, obj, lock):
-  with lock:
-    pm.dump(obj)
+# どのグループにも入らなかった代表は、完全一致のファイルだけでグループにする
+# targetPathがあるときは同じ側のファイル同士を組にしないので書かない
+def dumpExactGroups(exactGroups, fails, dirs, writer, checkpoint=None, *, isSelf=True):
+  failed = set(fails)
+  for path in list(exactGroups):
+    if path in failed:
+      fails.extend(data["path"] for data in exactGroups.pop(path)[1:])
+      continue
+    if not isSelf:
+      del exactGroups[path]
+      continue
+    representative = exactGroups[path][0]
+    U.delKeys(representative, FEATURE_KEYS)
+    representative["target"] = True
+    sames = [representative]
+    attachCopies(sames, exactGroups, dirs)
+    dirs[representative["path"].parent]["sames"] += 1
+    writer.put(sames)
+    if checkpoint is not None:
+      checkpoint.addGroup(sames)
 
 
 def check(result, other, sames, others, fails, dirs):
   isSame, diff = result
   if isSame:
     others.remove(other)
-    U.delKeys(other, ["descriptors", "pHash"])
+    U.delKeys(other, FEATURE_KEYS)
     other["diff"] = diff
     sames.append(other)
     dirs[other["path"].parent]["sames"] += 1
-  elif diff is None:
+    return True
+  if diff is None:
     others.remove(other)
     fails.append(other["path"])
+    return True
+  return False
+
+
+def printPruning(ratioIndex):
+  pf.count("pruned", ratioIndex.countPruned)
+  progress.flush()
+  print()
+  print(f"ratio: {ratioIndex.countPruned}/{ratioIndex.countPair} pairs pruned ({ratioIndex.getPruningRate():.1%})")
+
+
+def findSamesPHash(targets, others, threshold, indexName="linear", diffRatio=0.2, hashBounds=None):
+  isSelf = targets is others
+  hashes = u.packPHashes(others)
+  ratios = u.getRatios(others)
+  targetHashes, targetRatios = (hashes, ratios) if isSelf else (u.packPHashes(targets), u.getRatios(targets))
+  if hashBounds:
+    extras = mh.packHashes(others, hashBounds)
+    targetExtras = extras if isSelf else mh.packHashes(targets, hashBounds)
+  index = phi.createIndex(indexName, hashes, threshold)
+  alive = np.ones(len(others), dtype=bool)
+  for i in reversed(range(len(targets))):
+    if isSelf:
+      if not alive[i]:
+        continue
+      alive[i] = False
+    indices, diffs = index.query(targetHashes[i])
+    mask = alive[indices] & (np.abs(ratios[indices] - targetRatios[i]) <= diffRatio)
+    if hashBounds:
+      mask &= mh.getMask(targetExtras, i, extras, indices, hashBounds)
+    pf.count("pairs", len(indices))
+    indices, diffs = indices[mask], diffs[mask]
+    pf.count("passed", len(indices))
+    alive[indices] = False
+    yield i, targets[i], [(others[j], float(d)) for j, d in zip(indices, diffs, strict=True)]
+
+
+def dumpSamesPHash(
+  targets,
+  others,
+  threshold,
+  dirs,
+  writer,
+  indexName="linear",
+  hashBounds=None,
+  checkpoint=None,
+  exactGroups=None,
+):
+  for i, target, results in findSamesPHash(targets, others, threshold, indexName, hashBounds=hashBounds):
+    target["target"] = True
+    sames = [target]
+    progress(f"{i}: {target['path'].parent.name} {target['path'].name}")
+    for other, diff in results:
+      U.delKeys(other, FEATURE_KEYS)
+      other["diff"] = diff
+      sames.append(other)
+      dirs[other["path"].parent]["sames"] += 1
+    U.delKeys(target, FEATURE_KEYS)
+    attachCopies(sames, exactGroups, dirs, isSelf=targets is others)
+    if len(sames) > 1:
+      dirs[target["path"].parent]["sames"] += 1
+      writer.put(sames)
+    if checkpoint is not None:
+      if len(sames) > 1:
+        checkpoint.addGroup(sames)
+      checkpoint.addTarget(target)
+      checkpoint.saveIfDue()
+
+
+def getEdgesPHash(targets, others, threshold, indexName="linear", diffRatio=0.2, hashBounds=None):
+  isSelf = targets is others
+  hashes = u.packPHashes(others)
+  ratios = u.getRatios(others)
+  targetHashes, targetRatios = (hashes, ratios) if isSelf else (u.packPHashes(targets), u.getRatios(targets))
+  if hashBounds:
+    extras = mh.packHashes(others, hashBounds)
+    targetExtras = extras if isSelf else mh.packHashes(targets, hashBounds)
+  index = phi.createIndex(indexName, hashes, threshold)
+  for i in range(len(targets)):
+    indices, diffs = index.query(targetHashes[i])
+    mask = np.abs(ratios[indices] - targetRatios[i]) <= diffRatio
+    if isSelf:
+      mask &= indices > i
+    if hashBounds:
+      mask &= mh.getMask(targetExtras, i, extras, indices, hashBounds)
+    pf.count("pairs", len(indices))
+    pf.count("passed", int(np.count_nonzero(mask)))
+    for j, diff in zip(indices[mask], diffs[mask], strict=True):
+      yield i, int(j), float(diff)
+
+
+def getEdgesDescriptor(targets, others, threshold, matcher, diffRatio=0.2):
+  isSelf = targets is others
+  ratios = u.getRatios(others)
+  targetRatios = ratios if isSelf else u.getRatios(targets)
+  ratioIndex = u.RatioIndex(ratios, diffRatio)
+  mask = np.ones(len(others), dtype=bool)
+  for i, target in enumerate(targets):
+    progress(f"{len(targets) - i}: {target['path'].parent.name} {target['path'].name}")
+    if isSelf:
+      mask[: i + 1] = False
+    for j in ratioIndex.query(targetRatios[i], mask).tolist():
+      with pf.timer("match"):
+        isSame, diff = u.isSameImage(target, others[j], threshold, None, matcher, diffRatio)
+      pf.count("pairs")
+      if isSame:
+        pf.count("passed")
+        yield i, j, diff
+  printPruning(ratioIndex)
+
+
+def getEdgesPrefilter(targets, others, threshold, matcher, k, countWord=16, diffRatio=0.2):
+  isSelf = targets is others
+  centers = gd.trainCodebook(others if isSelf else targets + others, countWord)
+  if centers is None:
+    print("prefilter: no descriptors to train the codebook, comparing all pairs")
+    yield from getEdgesDescriptor(targets, others, threshold, matcher, diffRatio)
+    return
+  vectors = gd.getVectors(others, centers)
+  targetVectors = vectors if isSelf else gd.getVectors(targets, centers)
+  candidates = sorted(gd.getCandidates(targetVectors, vectors, k, isSelf))
+  ratios = u.getRatios(others)
+  targetRatios = ratios if isSelf else u.getRatios(targets)
+  countCandidate = len(candidates)
+  candidates = [(i, j) for i, j in candidates if abs(targetRatios[i] - ratios[j]) <= diffRatio]
+  pf.count("pruned", countCandidate - len(candidates))
+  print(f"prefilter: {countCandidate} candidates, {countCandidate - len(candidates)} pruned by ratio")
+  for i, j in candidates:
+    with pf.timer("match"):
+      isSame, diff = u.isSameImage(targets[i], others[j], threshold, None, matcher, diffRatio)
+    pf.count("pairs")
+    if isSame:
+      pf.count("passed")
+      yield i, j, diff
+
+
+# pHashで緩く絞り込んだ組の画像だけ特徴点を計算して照合する
+def getEdgesCascade(
+  targets,
+  others,
+  threshold,
+  screenThreshold,
+  detector,
+  matcher,
+  ex,
+  fails,
+  indexName="linear",
+  *,
+  maxKeyPoint=None,
+  isHalf=False,
+  store=None,
+):
+  pairs = list(getEdgesPHash(targets, others, screenThreshold, indexName))
+  nodes = {}
+  for i, j, _ in pairs:
+    nodes[id(targets[i])] = targets[i]
+    nodes[id(others[j])] = others[j]
+  print(f"cascade: {len(pairs)} candidates, {len(nodes)} images to detect")
+  failed = set()
+  func = functools.partial(setDescriptors, detector=detector, maxKeyPoint=maxKeyPoint, isHalf=isHalf, store=store)
+  for success, data in ex.map(func, nodes.values()):
+    if not success:
+      fails.append(data["path"])
+      failed.add(id(data))
+      pf.count("fails")
+  for i, j, _ in pairs:
+    if id(targets[i]) in failed or id(others[j]) in failed:
+      continue
+    with pf.timer("match"):
+      target, other = u.toMatchable(targets[i]["descriptors"]), u.toMatchable(others[j]["descriptors"])
+      diff = IU.compareDescriptor(matcher, target, other)
+    pf.count("pairs")
+    if diff is not None and diff <= threshold:
+      pf.count("passed")
+      yield i, j, diff
+
+
+def dumpClusters(targets, others, edges, linkage, dirs, writer, exactGroups=None):
+  nodes = others if targets is others else targets + others
+  offset = 0 if targets is others else len(targets)
+  edges = ((i, j + offset, diff) for i, j, diff in edges)
+  if linkage == "greedy":
+    groups = cl.greedy(len(targets), len(nodes), edges, targets is others)
+  else:
+    groups = cl.cluster(len(nodes), edges, linkage)
+  for group in groups:
+    sames = []
+    for k, (node, diff) in enumerate(group):
+      data = nodes[node]
+      U.delKeys(data, FEATURE_KEYS)
+      if k == 0:
+        data["target"] = True
+      else:
+        data["diff"] = diff
+      sames.append(data)
+      dirs[data["path"].parent]["sames"] += 1
+    attachCopies(sames, exactGroups, dirs)
+    writer.put(sames)
+
+
+def getMatcher(method):
+  return getDetector(method)[2]
+
+
+def getFeatureParams(method, detector, *, isReduced=False, maxKeyPoint=None, isHalf=False):
+  params = method if detector is None else f"{method}:{detector.getDefaultName()}"
+  if isReduced and detector is None:
+    params += ":reduced"
+  if maxKeyPoint is not None and detector is not None:
+    params += f":max{maxKeyPoint}"
+  if isHalf and detector is not None:
+    params += ":half"
+  return params
 
 
 def getDetector(method):
   match method:
-    case "pHash":
+    case "pHash" | "cascade":
       return cv2.img_hash.PHash().create(), None, None
     case "AKAZE(MLDB)":  # 高速?
       return (
@@ -96,73 +565,448 @@ def getDetector(method):
       return None, cv2.ORB_create(), cv2.BFMatcher_create(cv2.NORM_HAMMING, crossCheck=True)
 
 
+def emitGroup(pm, sames, counts):
+  for data in sames:
+    U.delKeys(data, FEATURE_KEYS)
+    counts[data["path"].parent] += 1
+  with pf.timer("dump"):
+    pm.dump(sames)
+
+
+def writeFails(fails, failedPath):
+  if len(fails) > 1:
+    print(f"fails: {fails}")
+    with failedPath.open("wb") as file:
+      pickle.dump(fails, file)
+
+
 @D.printFuncInfo()
-def dumpSameImages(path, pickleOutput, failedPath, method, threshold, targetPath=None, extensions=None):
+def streamSameImages(
+  path,
+  pickleOutput,
+  failedPath,
+  threshold,
+  targetPath=None,
+  extensions=None,
+  *,
+  index="linear",
+  workers=None,
+  queueSize=256,
+  isReduced=False,
+):
+  if extensions is None:
+    extensions = [".jpg", ".png", ".webp", ".gif"]
   pm = U.PickleManager(pickleOutput)
   pm.dump(path)
   pm.dump(targetPath)
   pm.dump(extensions)
 
-  targets, others, dirs = getFiles(path, targetPath, extensions)
-  phObj, detector, matcher = getDetector(method)
+  func = functools.partial(setInfo, detector=None, isReduced=isReduced)
+  countWorker = workers if workers is not None else min(32, (os.cpu_count() or 1) + 4)
+  fails = []
+  dirs = {}
+  counts = collections.Counter()
+  if targetPath is None:
+    matcher = pl.IncrementalMatcher(threshold)
+    for i, (success, data) in enumerate(pl.stream(path, extensions, func, dirs, countWorker, queueSize)):
+      if not success:
+        fails.append(data["path"])
+        continue
+      matcher.add(data)
+      U.delKeys(data, ["pHash"])
+      progress(f"{i}: {data['path'].parent.name} {data['path'].name}")
+    for sames in matcher.getGroups():
+      emitGroup(pm, sames, counts)
+  else:
+    others = []
+    for success, data in pl.stream(path, extensions, func, dirs, countWorker, queueSize):
+      if success:
+        others.append(data)
+      else:
+        fails.append(data["path"])
+    otherPaths = {data["path"] for data in others}
+    matcher = pl.TargetMatcher(others, threshold, index)
+    targetDirs = {}
+    for i, (success, data) in enumerate(pl.stream(targetPath, extensions, func, targetDirs, countWorker, queueSize)):
+      if not success:
+        fails.append(data["path"])
+        continue
+      if data["path"] in otherPaths:
+        continue
+      progress(f"{i}: {data['path'].parent.name} {data['path'].name}")
+      sames = matcher.match(data)
+      if len(sames) > 1:
+        emitGroup(pm, sames, counts)
+    dirs = targetDirs | dirs
+  for parent, count in counts.items():
+    dirs[parent]["sames"] += count
+  pm.dump(dirs)
+  progress.flush()
+  print()
+  writeFails(fails, failedPath)
 
+
+def getEdgesWithin(nodes, members, threshold, diffRatio=0.2):
+  lt = [nodes[i] for i in members]
+  hashes = u.packPHashes(lt)
+  ratios = u.getRatios(lt)
+  mask, diffs = u.getSameMask(hashes[:, None], ratios[:, None], hashes, ratios, threshold, diffRatio)
+  for a, b in zip(*np.nonzero(np.triu(mask, 1)), strict=True):
+    yield members[a], members[b], float(diffs[a, b])
+
+
+@D.printFuncInfo()
+def incrementalSameImages(
+  path,
+  pickleOutput,
+  failedPath,
+  threshold,
+  statePath,
+  extensions=None,
+  *,
+  index="linear",
+  clustering="star",
+  workers=None,
+  isReduced=False,
+):
+  if extensions is None:
+    extensions = [".jpg", ".png", ".webp", ".gif"]
+  pm = U.PickleManager(pickleOutput)
+  pm.dump(path)
+  pm.dump(None)
+  pm.dump(extensions)
+
+  with pf.stage("walk"):
+    currents, dirs = u.getFiles(path, isRecurse=True, extensions=extensions)
+  previous, previousGroups = inc.loadState(statePath)
+  previousIndex = {data["path"]: i for i, data in enumerate(previous)}
   fails = []
-  lock = threading.Lock()
-  with cf.ThreadPoolExecutor() as ex:
+  unchanged = {}
+  news = []
+  with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+    list(ex.map(fc.statFile, currents))
+    for data in currents:
+      i = previousIndex.get(data["path"])
+      if i is not None and (previous[i]["size"], previous[i]["mtime"]) == (data.get("size"), data.get("mtime")):
+        data["pHash"] = previous[i]["pHash"]
+        data["shape"] = previous[i]["shape"]
+        unchanged[i] = data
+      else:
+        news.append(data)
+    countGone = len(previousIndex.keys() - {data["path"] for data in currents})
+    print(f"unchanged: {len(unchanged)}, new or changed: {len(news)}, gone: {countGone}")
+    with pf.stage("extract"):
+      setInfoAll(news, ex, fails, None, isReduced=isReduced)
+
+  nodes = [*unchanged.values(), *news]
+  countOld = len(unchanged)
+  nodeOf = {i: k for k, i in enumerate(unchanged)}
+  with pf.stage("compare"):
+    edges = [
+      (countOld + i, j, diff)
+      for i, j, diff in getEdgesPHash(news, nodes, threshold, index)
+      if j < countOld or j > countOld + i
+    ]
+    touched = {x for a, b, _ in edges for x in (a, b)}
+    groups = []
+    for group in previousGroups:
+      members = [(nodeOf[i], diff) for i, diff in group if i in nodeOf]
+      if len(members) == len(group) and all(k not in touched for k, _ in members):
+        groups.append(members)
+      elif len(members) > 1:
+        edges.extend(getEdgesWithin(nodes, [k for k, _ in members], threshold))
+    print(f"carried over: {len(groups)} groups")
+    groups.extend(cl.cluster(len(nodes), edges, "star" if clustering == "greedy" else clustering))
+  inc.saveState(statePath, nodes, groups)
+
+  counts = collections.Counter()
+  with pf.stage("dump"):
+    for group in groups:
+      sames = []
+      for node, diff in group:
+        data = nodes[node]
+        if diff is None:
+          data["target"] = True
+        else:
+          data["diff"] = diff
+        sames.append(data)
+      emitGroup(pm, sames, counts)
+  for parent, count in counts.items():
+    dirs[parent]["sames"] += count
+  pm.dump(dirs)
+  writeFails(fails, failedPath)
+
+
+@D.printFuncInfo()
+def dumpSameImages(
+  path,
+  pickleOutput,
+  failedPath,
+  method,
+  threshold,
+  targetPath=None,
+  extensions=None,
+  *,
+  index="linear",
+  cachePath=None,
+  executor="thread",
+  workers=None,
+  chunkSize=64,
+  stream=False,
+  queueSize=256,
+  isReduced=False,
+  clustering="greedy",
+  tiled=False,
+  tileSize=None,
+  maxInFlight=None,
+  prefilterK=None,
+  cascadeMethod="AKAZE(MLDB)",
+  screenThreshold=12.0,
+  statePath=None,
+  exact=False,
+  countReader=4,
+  maxKeyPoint=None,
+  isHalf=False,
+  isDescriptorStore=False,
+  hashBounds=None,
+  checkpointInterval=None,
+  isResume=False,
+  writeQueueSize=64,
+  syncPolicy="none",
+  thumbnailBox=None,
+  thumbnailDirectory=tn.DEFAULT_DIRECTORY,
+  thumbnailCacheBytes=2**30,
+):
+  if statePath is not None:
+    incrementalSameImages(
+      path,
+      pickleOutput,
+      failedPath,
+      threshold,
+      statePath,
+      extensions,
+      index=index,
+      clustering=clustering,
+      workers=workers,
+      isReduced=isReduced,
+    )
+    return
+  if stream:
+    with pf.stage("stream"):
+      streamSameImages(
+        path,
+        pickleOutput,
+        failedPath,
+        threshold,
+        targetPath,
+        extensions,
+        index=index,
+        workers=workers,
+        queueSize=queueSize,
+        isReduced=isReduced,
+      )
+    return
+  pm = U.PickleManager(pickleOutput)
+  pm.dump(path)
+  pm.dump(targetPath)
+  pm.dump(extensions)
+
+  with pf.stage("walk"):
+    targets, others, dirs = getFiles(path, targetPath, extensions)
+  fails = []
+  checkpoint = None
+  if checkpointInterval is not None:
+    key = (str(path), None if targetPath is None else str(targetPath), extensions, method, threshold)
+    checkpoint = cp.Checkpoint(pathlib.Path(pickleOutput).with_suffix(".ckpt"), key, checkpointInterval)
+    if isResume and checkpoint.load():
+      consumed = checkpoint.getConsumed()
+      targets[:] = [data for data in targets if data["path"] not in consumed]
+      if targetPath is not None:
+        others[:] = [data for data in others if data["path"] not in consumed]
+      for sames in checkpoint.groups:
+        pm.dump(sames)
+      checkpoint.countSames(dirs)
+      print(f"resume: {len(checkpoint.groups)} groups, {len(consumed)} files done, {len(targets)} targets left")
+    fails = checkpoint.fails
+  pf.count("targets", len(targets))
+  exactGroups = {}
+  if exact:
+    with pf.stage("exact"):
+      exactGroups = removeExactDuplicates(targets, others, countReader)
+  phObj, detector, matcher = getDetector(method)
+  params = getFeatureParams(method, detector, isReduced=isReduced, maxKeyPoint=maxKeyPoint, isHalf=isHalf)
+  cache = None if cachePath is None else fc.FeatureCache(cachePath, method, params)
+
+  with (
+    gw.GroupWriter(pm, pickleOutput, writeQueueSize, syncPolicy) as writer,
+    cf.ThreadPoolExecutor(max_workers=workers) as ex,
+    tempfile.TemporaryDirectory(prefix="dumpSameImages_", ignore_cleanup_errors=True) as scratchDir,
+  ):
     start = time.perf_counter()
     U.printTime("Calculating ...")
-    setInfoAll(targets, ex, fails, detector)
-    if targetPath is not None:
-      setInfoAll(others, ex, fails, detector)
+    store = ds.DescriptorStore(scratchDir) if isDescriptorStore else None
+    thumbnailCache = None
+    if thumbnailBox is not None and executor != "process":
+      thumbnailCache = tn.ThumbnailCache(thumbnailDirectory, thumbnailCacheBytes, memoryBytes=0)
+    options = {
+      "isReduced": isReduced,
+      "maxKeyPoint": maxKeyPoint,
+      "isHalf": isHalf,
+      "store": store,
+      "hashNames": tuple(hashBounds or ()),
+      "thumbnailCache": thumbnailCache,
+      "thumbnailBox": thumbnailBox,
+    }
+    pex = None
+    if executor == "process":
+      hashNames = tuple(hashBounds or ())
+      initargs = (method, isReduced, maxKeyPoint, isHalf, hashNames, pf.current.path, pf.current.isCProfile)
+      initargs += (thumbnailDirectory, thumbnailBox, thumbnailCacheBytes)
+      pex = cf.ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=initargs)
+    # 抽出で例外が出てもワーカープロセスを残さない
+    with pf.stage("extract"), contextlib.nullcontext() if pex is None else pex:
+      setInfoAll(targets, ex, fails, detector, cache, pex, scratchDir, chunkSize, **options)
+      if targetPath is not None:
+        setInfoAll(others, ex, fails, detector, cache, pex, scratchDir, chunkSize, **options)
     sec = time.perf_counter() - start
     U.printTime(TU.getTimeStr(sec), f"({sec:10.6f})")
-
-    while len(targets) > 0:
-      target = targets.pop()
-      target["target"] = True
-      sames = [target]
-      print(f"\r\x1b[1M{len(others)}: {target['path'].parent.name} {target['path'].name}", end="")
-      for other in others[:]:
-        r = u.isSameImage(target, other, threshold, phObj, matcher)
-        check(r, other, sames, others, fails, dirs)
-      U.delKeys(target, ["descriptors", "pHash"])
-      if len(sames) > 1:
-        dirs[target["path"].parent]["sames"] += 1
-        ex.submit(dump, pm, sames, lock)
-  pm.dump(dirs)
+    if cache is not None:
+      print(f"cache: {cache.countHit} hits, {cache.countMiss} misses, {cache.evict()} evicted")
+      pf.count("cacheHits", cache.countHit)
+      cache.close()
+    with pf.stage("compare"), cp.saveOnError(checkpoint):
+      if method == "cascade":
+        _, cascadeDetector, cascadeMatcher = getDetector(cascadeMethod)
+        edges = getEdgesCascade(
+          targets,
+          others,
+          threshold,
+          screenThreshold,
+          cascadeDetector,
+          cascadeMatcher,
+          ex,
+          fails,
+          index,
+          maxKeyPoint=maxKeyPoint,
+          isHalf=isHalf,
+          store=store,
+        )
+        dumpClusters(targets, others, edges, clustering, dirs, writer, exactGroups)
+      elif prefilterK is not None and phObj is None:
+        edges = getEdgesPrefilter(targets, others, threshold, matcher, prefilterK)
+        dumpClusters(targets, others, edges, clustering, dirs, writer, exactGroups)
+      elif clustering != "greedy":
+        if tiled:
+          factory = None if phObj is not None else functools.partial(getMatcher, method)
+          edges = tc.compareTiles(targets, others, threshold, scratchDir, factory, workers, tileSize, maxInFlight)
+        elif phObj is not None:
+          edges = getEdgesPHash(targets, others, threshold, index, hashBounds=hashBounds)
+        else:
+          edges = getEdgesDescriptor(targets, others, threshold, matcher)
+        dumpClusters(targets, others, edges, clustering, dirs, writer, exactGroups)
+      elif phObj is not None:
+        dumpSamesPHash(targets, others, threshold, dirs, writer, index, hashBounds, checkpoint, exactGroups)
+      else:
+        # othersから消えた画像はaliveで除外し、比の範囲外の組は照合しない
+        candidates = list(others)
+        positions = {id(data): j for j, data in enumerate(candidates)}
+        ratioIndex = u.RatioIndex(u.getRatios(candidates))
+        alive = np.ones(len(candidates), dtype=bool)
+        while len(targets) > 0:
+          target = targets.pop()
+          target["target"] = True
+          sames = [target]
+          progress(f"{len(others)}: {target['path'].parent.name} {target['path'].name}")
+          if id(target) in positions:
+            alive[positions[id(target)]] = False
+          for j in ratioIndex.query(IU.getRatio(target["shape"]), alive).tolist():
+            with pf.timer("match"):
+              r = u.isSameImage(target, candidates[j], threshold, phObj, matcher)
+            pf.count("pairs")
+            if check(r, candidates[j], sames, others, fails, dirs):
+              alive[j] = False
+          pf.count("passed", len(sames) - 1)
+          U.delKeys(target, FEATURE_KEYS)
+          attachCopies(sames, exactGroups, dirs, isSelf=targetPath is None)
+          if len(sames) > 1:
+            dirs[target["path"].parent]["sames"] += 1
+            writer.put(sames)
+          if checkpoint is not None:
+            if len(sames) > 1:
+              checkpoint.addGroup(sames)
+            checkpoint.addTarget(target)
+            checkpoint.saveIfDue()
+        printPruning(ratioIndex)
+      dumpExactGroups(exactGroups, fails, dirs, writer, checkpoint, isSelf=targetPath is None)
+    if store is not None:
+      pf.count("descriptorBytes", store.nbytes())
+      store.close()
+    writer.close(dirs)
+  if checkpoint is not None:
+    checkpoint.remove()
+  progress.flush()
   print()
-  if len(fails) > 1:
-    print(f"fails: {fails}")
-    with failedPath.open("wb") as file:
-      pickle.dump(fails, file)
-
+  writeFails(fails, failedPath)
 
-def getPHashDiff(target, other, phObj=None):
-  diff = u.comparePHash(target["pHash"], other["pHash"], phObj)
-  return target["path"], other["path"], diff
 
-
-def comparePHash(path, failedPath, targetPath=None, extensions=None):
+# 閾値調整用。距離はブロック単位で計算し、
+# 全体のヒストグラムと画像ごとに近い順のtopK件だけを保持して書き出す
+def comparePHash(
+  path,
+  failedPath,
+  targetPath=None,
+  extensions=None,
+  *,
+  outputPath=None,
+  topK=5,
+  blockSize=1024,
+  diffRatio=0.2,
+):
   targets, others, _ = getFiles(path, targetPath, extensions)
-  phObj = cv2.img_hash.PHash().create()
   fails = []
-  result = []
   with cf.ThreadPoolExecutor() as ex:
     setInfoAll(targets, ex, fails, None)
     if targetPath is not None:
       setInfoAll(others, ex, fails, None)
-    while len(targets) > 0:
-      target = targets.pop()
-      target["target"] = True
-      print(f"\r\x1b[1M{len(others)}: {target['path'].parent.name} {target['path'].name}", end="")
-      result.extend([getPHashDiff(target, other, phObj) for other in others])
+  isSelf = targets is others
+  hashes, ratios = u.packPHashes(others), u.getRatios(others)
+  targetHashes, targetRatios = (hashes, ratios) if isSelf else (u.packPHashes(targets), u.getRatios(targets))
+  histogram = np.zeros(65, dtype=np.int64)
+  nearHistogram = np.zeros(65, dtype=np.int64)
+  if outputPath is None:
+    outputPath = pathlib.Path(path, f"pHashDiff_{path.stem}.csv")
+  with dg.PairWriter(outputPath) as writer:
+    for r0 in range(0, len(targets), blockSize):
+      r1 = min(r0 + blockSize, len(targets))
+      rows = np.arange(r0, r1)
+      bestDiffs = np.empty((r1 - r0, 0), dtype=np.int16)
+      bestIndices = np.empty((r1 - r0, 0), dtype=np.intp)
+      for c0 in range(0, len(others), blockSize):
+        c1 = min(c0 + blockSize, len(others))
+        columns = np.arange(c0, c1)
+        diffs = u.hammingDistances(targetHashes[r0:r1, None], hashes[None, c0:c1]).astype(np.int16)
+        near = np.abs(targetRatios[r0:r1, None] - ratios[None, c0:c1]) <= diffRatio
+        counted = rows[:, None] < columns[None, :] if isSelf else np.ones(diffs.shape, dtype=bool)
+        histogram += np.bincount(diffs[counted], minlength=65)
+        nearHistogram += np.bincount(diffs[counted & near], minlength=65)
+        if isSelf:
+          diffs[rows[:, None] == columns[None, :]] = dg.NO_PAIR
+        indices = np.broadcast_to(columns, diffs.shape)
+        bestDiffs, bestIndices = dg.updateTopK(bestDiffs, bestIndices, diffs, indices, topK)
+      for i, (rowDiffs, rowIndices) in enumerate(zip(bestDiffs.tolist(), bestIndices.tolist(), strict=True)):
+        target = targets[r0 + i]
+        for rank, (diff, j) in enumerate(zip(rowDiffs, rowIndices, strict=True)):
+          if diff != dg.NO_PAIR:
+            writer.writePair(target["path"], others[j]["path"], rank, diff, abs(targetRatios[r0 + i] - ratios[j]))
+      progress(f"{r1}/{len(targets)}: {targets[r1 - 1]['path'].parent.name} {targets[r1 - 1]['path'].name}")
+    writer.writeHistogram(histogram, nearHistogram)
+  progress.flush()
   print()
-  if len(fails) > 1:
-    print(f"fails: {fails}")
-    with failedPath.open("wb") as file:
-      pickle.dump(fails, file)
-  for x in result:
-    print(f"{x[2]:5}: \n{x[0]}\n{x[1]}\n")
+  writeFails(fails, failedPath)
+  print(f"pairs: {histogram.sum()}, within ratio: {nearHistogram.sum()}")
+  for diff in np.flatnonzero(histogram)[:16]:
+    print(f"{diff:5}: {histogram[diff]:12} {nearHistogram[diff]:12}")
+  print(f'outputPath: "{outputPath}"')
 
 
 def setThreshold(method):
@@ -185,9 +1029,44 @@ def argumentParser():
   parser.add_argument("-t", "--targetPath", type=pathlib.Path, default=None)
   parser.add_argument("-o", "--outputPath", type=pathlib.Path, default=None)
   parser.add_argument("-f", "--failedPath", type=pathlib.Path, default=None)
-  parser.add_argument("-m", "--method", choices=["pHash", "AKAZE(MLDB)", "AKAZE(KAZE)", "KAZE", "ORB"], default="pHash")
+  descriptorMethods = ["AKAZE(MLDB)", "AKAZE(KAZE)", "KAZE", "ORB"]
+  parser.add_argument("-m", "--method", choices=["pHash", *descriptorMethods, "cascade"], default="pHash")
   parser.add_argument("-th", "--threshold", type=float, default=None)
   parser.add_argument("-e", "--extensions", nargs="*", default=[".jpg", ".png", ".webp", ".gif"])
+  parser.add_argument("-i", "--index", choices=phi.getIndexNames(), default="linear")
+  parser.add_argument("-c", "--cachePath", type=pathlib.Path, default=None)
+  parser.add_argument("-x", "--executor", choices=["thread", "process"], default="thread")
+  parser.add_argument("-w", "--workers", type=int, default=None)
+  parser.add_argument("--chunkSize", type=int, default=64)
+  parser.add_argument("-s", "--stream", action="store_true")
+  parser.add_argument("--queueSize", type=int, default=256)
+  parser.add_argument("-r", "--reduced", action="store_true")
+  parser.add_argument("-l", "--clustering", choices=["greedy", *cl.getLinkageNames()], default="greedy")
+  parser.add_argument("--tiled", action="store_true")
+  parser.add_argument("--tileSize", type=int, default=None)
+  parser.add_argument("--maxInFlight", type=int, default=None)
+  parser.add_argument("-k", "--prefilterK", type=int, default=None)
+  parser.add_argument("--cascadeMethod", choices=descriptorMethods, default="AKAZE(MLDB)")
+  parser.add_argument("--screenThreshold", type=float, default=12.0)
+  parser.add_argument("--statePath", type=pathlib.Path, default=None)
+  parser.add_argument("-z", "--compact", action="store_true")
+  parser.add_argument("-X", "--exact", action="store_true")
+  parser.add_argument("--countReader", type=int, default=4)
+  parser.add_argument("--maxKeyPoint", type=int, default=None)
+  parser.add_argument("--half", action="store_true")
+  parser.add_argument("-d", "--descriptorStore", action="store_true")
+  parser.add_argument("-H", "--hashes", nargs="*", default=None, metavar="NAME[:BOUND]")
+  parser.add_argument("--checkpointInterval", type=float, default=None)
+  parser.add_argument("--resume", action="store_true")
+  parser.add_argument("--writeQueueSize", type=int, default=64)
+  parser.add_argument("--sync", choices=gw.SYNC_POLICIES, default="none")
+  parser.add_argument("--thumbnailBox", type=int, nargs=2, default=None, metavar=("WIDTH", "HEIGHT"))
+  parser.add_argument("--thumbnailCache", type=pathlib.Path, default=None)
+  parser.add_argument("--thumbnailCacheSize", type=int, default=1024, metavar="MiB")
+  parser.add_argument("--diagnose", type=pathlib.Path, default=None, metavar="OUTPUT.csv|OUTPUT.ndjson")
+  parser.add_argument("--topK", type=int, default=5)
+  parser.add_argument("-p", "--profile", type=pathlib.Path, default=None)
+  parser.add_argument("--cProfile", action="store_true")
   args = parser.parse_args()
   path = args.path.absolute()
   if not path.exists():
@@ -195,32 +1074,119 @@ def argumentParser():
     sys.exit()
 
   method = args.method
+  if args.stream and method != "pHash":
+    parser.error("--stream supports only pHash.")
+  if args.stream and args.clustering != "greedy":
+    parser.error("--stream supports only greedy clustering.")
+  if args.statePath is not None and (method != "pHash" or args.targetPath is not None or args.stream):
+    parser.error("--statePath supports only pHash without --targetPath and --stream.")
+  if args.tiled and args.clustering == "greedy":
+    parser.error("--tiled needs --clustering single, complete or star.")
+  if args.exact and (args.stream or args.statePath is not None):
+    parser.error("--exact does not support --stream and --statePath.")
+  hashBounds = None
+  if args.hashes:
+    if method != "pHash" or args.stream or args.statePath is not None or args.tiled or args.cachePath is not None:
+      parser.error("--hashes supports only pHash without --stream, --statePath, --tiled and --cachePath.")
+    try:
+      hashBounds = mh.parseBounds(args.hashes)
+    except ValueError as e:
+      parser.error(str(e))
+    if args.reduced and "colorMoment" in hashBounds:
+      parser.error("--reduced decodes in grayscale, so colorMoment cannot be used.")
+  checkpointInterval = args.checkpointInterval
+  if args.resume and checkpointInterval is None:
+    checkpointInterval = 300.0
+  isGreedy = args.clustering == "greedy" and method != "cascade" and args.prefilterK is None
+  if checkpointInterval is not None and (not isGreedy or args.stream or args.statePath is not None):
+    parser.error("--resume supports only greedy clustering without cascade, --prefilterK, --stream and --statePath.")
+  if args.cProfile and args.profile is None:
+    parser.error("--cProfile needs --profile.")
+  if args.thumbnailBox is not None and (args.stream or args.statePath is not None):
+    parser.error("--thumbnailBox does not support --stream and --statePath.")
   threshold = args.threshold
   if threshold is None:
-    threshold = setThreshold(method)
+    threshold = setThreshold(args.cascadeMethod if method == "cascade" else method)
 
   picklePath = pathlib.Path(path, f"pHash_{path.stem}.pkl") if args.outputPath is None else args.outputPath
   failedPath = pathlib.Path(path, f"failed_{path.stem}.pkl") if args.failedPath is None else args.failedPath
   targetPath = args.targetPath.absolute() if args.targetPath is not None else None
-  return (path, picklePath, failedPath, targetPath, method, threshold, args.extensions)
+  cachePath = args.cachePath.absolute() if args.cachePath is not None else None
+  statePath = args.statePath.absolute() if args.statePath is not None else None
+  profilePath = args.profile.absolute() if args.profile is not None else None
+  thumbnailDirectory = tn.DEFAULT_DIRECTORY if args.thumbnailCache is None else args.thumbnailCache.absolute()
+  options = {
+    "index": args.index,
+    "cachePath": cachePath,
+    "executor": args.executor,
+    "workers": args.workers,
+    "chunkSize": args.chunkSize,
+    "stream": args.stream,
+    "queueSize": args.queueSize,
+    "isReduced": args.reduced,
+    "clustering": args.clustering,
+    "tiled": args.tiled,
+    "tileSize": args.tileSize,
+    "maxInFlight": args.maxInFlight,
+    "prefilterK": args.prefilterK,
+    "cascadeMethod": args.cascadeMethod,
+    "screenThreshold": args.screenThreshold,
+    "statePath": statePath,
+    "exact": args.exact,
+    "countReader": args.countReader,
+    "maxKeyPoint": args.maxKeyPoint,
+    "isHalf": args.half,
+    "isDescriptorStore": args.descriptorStore,
+    "hashBounds": hashBounds,
+    "checkpointInterval": checkpointInterval,
+    "diagnosePath": args.diagnose.absolute() if args.diagnose is not None else None,
+    "topK": args.topK,
+    "isResume": args.resume,
+    "writeQueueSize": args.writeQueueSize,
+    "syncPolicy": args.sync,
+    "thumbnailBox": tuple(args.thumbnailBox) if args.thumbnailBox is not None else None,
+    "thumbnailDirectory": thumbnailDirectory,
+    "thumbnailCacheBytes": args.thumbnailCacheSize * 2**20,
+    "isCompact": args.compact,
+    "profilePath": profilePath,
+    "isCProfile": args.cProfile,
+  }
+  return (path, picklePath, failedPath, targetPath, method, threshold, args.extensions, options)
 
 
-def printArgs(path, picklePath, failedPath, targetPath, method, threshold, extensions):
+def printArgs(path, picklePath, failedPath, targetPath, method, threshold, extensions, options):
   print(f'directory:  "{path}"')
   print(f"method:      {method}")
   print(f"threshold:   {threshold}")
   print(f'picklePath: "{picklePath}"')
   print(f'failedPath: "{failedPath}"')
   print(f'targetPath: "{targetPath}"')
-  print(f'extensions: "{extensions}"\n')
+  print(f'extensions: "{extensions}"')
+  for k, v in options.items():
+    print(f"{k + ':':17}{v}")
+  print()
 
 
 if __name__ == "__main__":
-  path, picklePath, failedPath, targetPath, method, threshold, extensions = argumentParser()
-  printArgs(path, picklePath, failedPath, targetPath, method, threshold, extensions)
+  path, picklePath, failedPath, targetPath, method, threshold, extensions, options = argumentParser()
+  printArgs(path, picklePath, failedPath, targetPath, method, threshold, extensions, options)
 
-  # comparePHash(path, failedPath, targetPath)
-  dumpSameImages(path, picklePath, failedPath, method, threshold, targetPath, extensions)
+  diagnosePath, topK = options.pop("diagnosePath"), options.pop("topK")
+  if diagnosePath is not None:
+    comparePHash(path, failedPath, targetPath, extensions, outputPath=diagnosePath, topK=topK)
+    sys.exit()
+  isCompact = options.pop("isCompact")
+  profilePath = options.pop("profilePath")
+  pf.configure(profilePath, isCProfile=options.pop("isCProfile")).startCProfile()
+  dumpSameImages(path, picklePath, failedPath, method, threshold, targetPath, extensions, **options)
+  if profilePath is not None:
+    pf.current.write()
+    print(f'profilePath: "{profilePath}"')
+  if isCompact:
+    compactPath = picklePath.with_suffix(".sig")
+    gf.convert(picklePath, compactPath)
+    print(f'compactPath: "{compactPath}"')
+    picklePath = compactPath
 
   rsip.printSameImagePickle(picklePath)
-  printArgs(path, picklePath, failedPath, targetPath, method, threshold, extensions)
+  printArgs(path, picklePath, failedPath, targetPath, method, threshold, extensions, options)
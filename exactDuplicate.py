@@ -0,0 +1,55 @@
+import collections
+import concurrent.futures as cf
+import hashlib
+import os
+
+import featureCache as fc
+
+BLOCK_SIZE = 2**16
+
+
+def getPartialHash(data, blockSize=BLOCK_SIZE):
+  h = hashlib.blake2b(digest_size=16)
+  try:
+    with data["path"].open("rb") as file:
+      h.update(file.read(blockSize))
+      if data["size"] > 2 * blockSize:
+        file.seek(-blockSize, os.SEEK_END)
+      h.update(file.read())
+  except OSError:
+    return None
+  return h.digest()
+
+
+def getFullHash(data, bufferSize=2**20):
+  h = hashlib.blake2b(digest_size=32)
+  try:
+    with data["path"].open("rb") as file:
+      while chunk := file.read(bufferSize):
+        h.update(chunk)
+  except OSError:
+    return None
+  return h.digest()
+
+
+def split(groups, func, ex):
+  lt = [data for group in groups for data in group]
+  buckets = collections.defaultdict(list)
+  for data, key in zip(lt, ex.map(func, lt), strict=True):
+    if key is not None:
+      buckets[(data["size"], key)].append(data)
+  return [group for group in buckets.values() if len(group) > 1]
+
+
+# サイズ -> 先頭と末尾の部分ハッシュ -> 全体のハッシュの順に絞り込む
+def findGroups(lt, countReader=4):
+  with cf.ThreadPoolExecutor(max_workers=countReader) as ex:
+    list(ex.map(fc.statFile, lt))
+    bySize = collections.defaultdict(list)
+    for data in lt:
+      if data.get("size", -1) > 0:
+        bySize[data["size"]].append(data)
+    groups = split([group for group in bySize.values() if len(group) > 1], getPartialHash, ex)
+    partials = [group for group in groups if group[0]["size"] <= 2 * BLOCK_SIZE]
+    fulls = split([group for group in groups if group[0]["size"] > 2 * BLOCK_SIZE], getFullHash, ex)
+  return partials + fulls
@@ -0,0 +1,95 @@
+import os
+import pathlib
+import sqlite3
+
+import numpy as np
+
+
+def statFile(data):
+  if "size" not in data or "mtime" not in data:
+    try:
+      st = os.stat(data["path"])
+    except OSError:
+      return data
+    data["size"] = st.st_size
+    data["mtime"] = st.st_mtime_ns
+  return data
+
+
+class FeatureCache:
+  def __init__(self, path, method, params=""):
+    self.path = pathlib.Path(path)
+    self.method = method
+    self.params = params
+    self.connection = sqlite3.connect(self.path, check_same_thread=False)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute(
+      "CREATE TABLE IF NOT EXISTS features ("
+      "path TEXT, size INTEGER, mtime INTEGER, method TEXT, params TEXT, "
+      "shape TEXT, pHash BLOB, descriptors BLOB, dtype TEXT, columns INTEGER, "
+      "PRIMARY KEY (path, method, params))",
+    )
+    self.pending = []
+    self.countHit = 0
+    self.countMiss = 0
+
+  def close(self):
+    self.commit()
+    self.connection.close()
+
+  def get(self, data):
+    if "size" not in data:
+      self.countMiss += 1
+      return False
+    row = self.connection.execute(
+      "SELECT size, mtime, shape, pHash, descriptors, dtype, columns FROM features "
+      "WHERE path = ? AND method = ? AND params = ?",
+      (str(data["path"]), self.method, self.params),
+    ).fetchone()
+    if row is None or row[0] != data["size"] or row[1] != data["mtime"]:
+      self.countMiss += 1
+      return False
+    _size, _mtime, shape, pHash, descriptors, dtype, columns = row
+    data["shape"] = tuple(int(x) for x in shape.split(","))
+    data["pHash"] = np.frombuffer(pHash, dtype=np.uint8).reshape(1, -1)
+    if descriptors is not None:
+      data["descriptors"] = np.frombuffer(descriptors, dtype=dtype).reshape(-1, columns)
+    self.countHit += 1
+    return True
+
+  def put(self, data):
+    if "size" not in data:
+      return
+    descriptors = data.get("descriptors")
+    self.pending.append(
+      (
+        str(data["path"]),
+        data["size"],
+        data["mtime"],
+        self.method,
+        self.params,
+        ",".join(str(x) for x in data["shape"]),
+        data["pHash"].tobytes(),
+        None if descriptors is None else descriptors.tobytes(),
+        None if descriptors is None else descriptors.dtype.str,
+        None if descriptors is None else descriptors.shape[1],
+      ),
+    )
+    if len(self.pending) >= 1000:  # noqa: PLR2004
+      self.commit()
+
+  def commit(self):
+    if len(self.pending) > 0:
+      with self.connection:
+        self.connection.executemany(
+          "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+          self.pending,
+        )
+      self.pending = []
+
+  def evict(self):
+    paths = [row[0] for row in self.connection.execute("SELECT DISTINCT path FROM features")]
+    removes = [(x,) for x in paths if not pathlib.Path(x).exists()]
+    with self.connection:
+      self.connection.executemany("DELETE FROM features WHERE path = ?", removes)
+    return len(removes)
@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+
+def toFloat(descriptors):
+  if descriptors.dtype == np.uint8:  # バイナリ記述子はビットに展開する
+    return np.unpackbits(np.asarray(descriptors), axis=1).astype(np.float32)
+  return np.asarray(descriptors, dtype=np.float32)
+
+
+def trainCodebook(lt, countWord=16, countSample=20000, seed=0):
+  rng = np.random.default_rng(seed)
+  perImage = max(1, countSample // max(1, len(lt)))
+  samples = []
+  for data in lt:
+    descriptors = data["descriptors"]
+    indices = rng.choice(len(descriptors), size=min(perImage, len(descriptors)), replace=False)
+    samples.append(toFloat(descriptors[np.sort(indices)]))
+  if sum(map(len, samples)) == 0:  # 記述子が1つもなければ学習できない
+    return None
+  samples = np.concatenate(samples)
+  countWord = min(countWord, len(samples))
+  cv2.setRNGSeed(seed)
+  criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-3)
+  _, _, centers = cv2.kmeans(samples, countWord, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+  return centers
+
+
+def getVlad(descriptors, centers):
+  x = toFloat(descriptors)
+  distances = (x * x).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers * centers).sum(axis=1)[None, :]
+  words = np.argmin(distances, axis=1)
+  vlad = np.zeros_like(centers)
+  np.add.at(vlad, words, x - centers[words])
+  vlad = np.sign(vlad) * np.sqrt(np.abs(vlad))
+  vlad = vlad.ravel()
+  norm = np.linalg.norm(vlad)
+  return vlad / norm if norm > 0 else vlad
+
+
+def getVectors(lt, centers):
+  if len(lt) == 0:
+    return np.empty((0, centers.size))
+  return np.vstack([getVlad(data["descriptors"], centers) for data in lt])
+
+
+# targetsの各画像について、大域ベクトルが近い上位k個の組を返す
+def getCandidates(targetVectors, vectors, k, isSelf, blockSize=1024):
+  k = min(k, len(vectors) - 1 if isSelf else len(vectors))
+  if k <= 0:
+    return set()
+  candidates = set()
+  for start in range(0, len(targetVectors), blockSize):
+    similarities = targetVectors[start : start + blockSize] @ vectors.T
+    if isSelf:
+      rows = np.arange(len(similarities))
+      similarities[rows, rows + start] = -np.inf
+    tops = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    for i, row in enumerate(tops.tolist(), start):
+      for j in row:
+        candidates.add((min(i, j), max(i, j)) if isSelf else (i, j))
+  return candidates
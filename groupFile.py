@@ -0,0 +1,189 @@
+import argparse
+import json
+import pathlib
+
+import numpy as np
+
+import Utility as U
+
+MAGIC = b"SAMEIMG1"
+ALIGNMENT = 64
+
+
+class StringTable:
+  def __init__(self):
+    self.indices = {}
+
+  def add(self, text):
+    return self.indices.setdefault(text, len(self.indices))
+
+  def toArrays(self):
+    encoded = [x.encode("utf_8") for x in self.indices]
+    offsets = np.cumsum([0, *map(len, encoded)]).astype(np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def toArrays(groups, dirs):
+  dirTable = StringTable()
+  nameTable = StringTable()
+  for directory in dirs:
+    dirTable.add(str(directory))
+  fileDirs, fileNames, shapes, diffs, targets, offsets = [], [], [], [], [], [0]
+  for group in groups:
+    for data in group:
+      fileDirs.append(dirTable.add(str(data["path"].parent)))
+      fileNames.append(nameTable.add(data["path"].name))
+      shape = list(data["shape"])[:3]
+      shapes.append(shape + [-1] * (3 - len(shape)))
+      diff = data.get("diff")
+      diffs.append(np.nan if diff is None else diff)
+      targets.append(data.get("target", False))
+    offsets.append(len(fileDirs))
+  dirBytes, dirOffsets = dirTable.toArrays()
+  nameBytes, nameOffsets = nameTable.toArrays()
+  dirTotals = np.zeros(len(dirTable.indices), dtype=np.int64)
+  dirSames = np.zeros(len(dirTable.indices), dtype=np.int64)
+  dirKnown = np.zeros(len(dirTable.indices), dtype=np.uint8)
+  for directory, v in dirs.items():
+    i = dirTable.indices[str(directory)]
+    dirTotals[i] = v["total"]
+    dirSames[i] = v["sames"]
+    dirKnown[i] = 1
+  return {
+    "dirBytes": dirBytes,
+    "dirOffsets": dirOffsets,
+    "nameBytes": nameBytes,
+    "nameOffsets": nameOffsets,
+    "groupOffsets": np.array(offsets, dtype=np.int32),
+    "fileDirs": np.array(fileDirs, dtype=np.int32),
+    "fileNames": np.array(fileNames, dtype=np.int32),
+    "shapes": np.array(shapes, dtype=np.int32).reshape(-1, 3),
+    "diffs": np.array(diffs, dtype=np.float32),
+    "targets": np.array(targets, dtype=np.uint8),
+    "dirTotals": dirTotals,
+    "dirSames": dirSames,
+    "dirKnown": dirKnown,
+  }
+
+
+def write(path, directory, targetPath, extensions, groups, dirs):
+  arrays = toArrays(groups, dirs)
+  header = {
+    "directory": str(directory),
+    "targetPath": None if targetPath is None else str(targetPath),
+    "extensions": extensions,
+    "arrays": {},
+  }
+  offset = 0
+  for name, array in arrays.items():
+    header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+    offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+  encoded = json.dumps(header).encode("utf_8")
+  start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+  with pathlib.Path(path).open("wb") as file:
+    file.write(MAGIC)
+    file.write(len(encoded).to_bytes(8, "little"))
+    file.write(encoded)
+    for name, array in arrays.items():
+      file.seek(start + header["arrays"][name]["offset"])
+      file.write(np.ascontiguousarray(array).tobytes())
+    file.truncate(start + offset)
+
+
+def isGroupFile(path):
+  with pathlib.Path(path).open("rb") as file:
+    return file.read(len(MAGIC)) == MAGIC
+
+
+class GroupFile:
+  def __init__(self, path):
+    self.path = pathlib.Path(path)
+    with self.path.open("rb") as file:
+      if file.read(len(MAGIC)) != MAGIC:
+        msg = f'"{self.path}" is not a group file.'
+        raise ValueError(msg)
+      length = int.from_bytes(file.read(8), "little")
+      header = json.loads(file.read(length).decode("utf_8"))
+    start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+    self.directory = pathlib.Path(header["directory"])
+    self.targetPath = None if header["targetPath"] is None else pathlib.Path(header["targetPath"])
+    self.extensions = header["extensions"]
+    self.buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+    self.arrays = {}
+    for name, v in header["arrays"].items():
+      dtype = np.dtype(v["dtype"])
+      count = int(np.prod(v["shape"]))
+      begin = start + v["offset"]
+      self.arrays[name] = self.buffer[begin : begin + count * dtype.itemsize].view(dtype).reshape(v["shape"])
+    self.dirCache = {}
+
+  def __len__(self):
+    return len(self.arrays["groupOffsets"]) - 1
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError(i)
+    start, end = self.arrays["groupOffsets"][i : i + 2].tolist()
+    return [self.getData(k) for k in range(start, end)]
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def getString(self, kind, i):
+    offsets = self.arrays[f"{kind}Offsets"]
+    return self.arrays[f"{kind}Bytes"][offsets[i] : offsets[i + 1]].tobytes().decode("utf_8")
+
+  def getDirectory(self, i):
+    if i not in self.dirCache:
+      self.dirCache[i] = pathlib.Path(self.getString("dir", i))
+    return self.dirCache[i]
+
+  def getData(self, k):
+    arrays = self.arrays
+    data = {
+      "path": pathlib.Path(
+        self.getDirectory(int(arrays["fileDirs"][k])),
+        self.getString("name", int(arrays["fileNames"][k])),
+      ),
+      "shape": tuple(x for x in arrays["shapes"][k].tolist() if x >= 0),
+    }
+    if arrays["targets"][k]:
+      data["target"] = True
+    if not np.isnan(arrays["diffs"][k]):
+      data["diff"] = float(arrays["diffs"][k])
+    return data
+
+  def getGroupSizes(self):
+    return np.diff(self.arrays["groupOffsets"])
+
+  def countFile(self):
+    return int(self.arrays["groupOffsets"][-1])
+
+  def getDirs(self):
+    known = np.flatnonzero(self.arrays["dirKnown"])
+    totals = self.arrays["dirTotals"]
+    sames = self.arrays["dirSames"]
+    return {self.getDirectory(int(i)): {"total": int(totals[i]), "sames": int(sames[i])} for i in known}
+
+
+def convert(picklePath, outputPath):
+  data = U.PickleManager(picklePath).loadExternal()
+  write(outputPath, data[0], data[1], data[2], data[3:-1], data[-1])
+
+
+def argumentParser():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("picklePath", type=pathlib.Path)
+  parser.add_argument("-o", "--outputPath", type=pathlib.Path, default=None)
+  args = parser.parse_args()
+  outputPath = args.picklePath.with_suffix(".sig") if args.outputPath is None else args.outputPath
+  return args.picklePath, outputPath
+
+
+if __name__ == "__main__":
+  picklePath, outputPath = argumentParser()
+  convert(picklePath, outputPath)
+  print(f'"{picklePath}" -> "{outputPath}"')
@@ -0,0 +1,99 @@
+import os
+import pathlib
+import queue
+import threading
+
+import profiler as pf
+
+SYNC_POLICIES = ["none", "batch", "close"]
+CLOSE = object()
+
+
+# グループの書き出し専用スレッド。キューが一杯になるとputが待つので、
+# 書き込みが遅くてもメモリは増えない
+# 書式はPickleManagerのものをそのまま使うため、書き込みは1グループずつになる
+# 溜まっている分はまとめて取り出し、syncPolicyが"batch"ならその分に1回だけfsyncする
+# fsyncは同じファイルを開き直して行うので、PickleManager.dumpが
+# 1レコードごとにファイルを閉じる(バッファに残さない)ことを前提にしている
+class GroupWriter:
+  def __init__(self, pm, path, queueSize=64, syncPolicy="none"):
+    if syncPolicy not in SYNC_POLICIES:
+      msg = f"unknown sync policy: {syncPolicy} (choose from {', '.join(SYNC_POLICIES)})"
+      raise ValueError(msg)
+    self.pm = pm
+    self.path = pathlib.Path(path)
+    self.syncPolicy = syncPolicy
+    self.queue = queue.Queue(maxsize=queueSize)
+    self.error = None
+    self.countRecord = 0
+    self.isClosed = False
+    self.thread = threading.Thread(target=self.run, name="GroupWriter", daemon=True)
+    self.thread.start()
+
+  def __enter__(self):
+    return self
+
+  # 例外で抜けるときは書けた分だけ残し、元の例外を優先する
+  def __exit__(self, excType, *args):
+    if excType is None:
+      self.close()
+    else:
+      self.stop()
+
+  def put(self, sames):
+    if self.error is not None:
+      raise self.error
+    self.queue.put(sames)
+
+  def getBatch(self):
+    batch = [self.queue.get()]
+    while len(batch) < self.queue.maxsize and batch[-1] is not CLOSE:
+      try:
+        batch.append(self.queue.get_nowait())
+      except queue.Empty:
+        break
+    return batch
+
+  # 書き込みに失敗しても取り出しは続け、putが待ち続けないようにする
+  def run(self):
+    while True:
+      batch = self.getBatch()
+      isClosed = batch[-1] is CLOSE
+      if isClosed:
+        batch.pop()
+      if self.error is None and len(batch) > 0:
+        try:
+          for sames in batch:
+            with pf.timer("dump"):
+              self.pm.dump(sames)
+          if self.syncPolicy == "batch":
+            self.sync()
+          self.countRecord += len(batch)
+        except Exception as e:  # noqa: BLE001
+          self.error = e
+      if isClosed:
+        return
+
+  def sync(self):
+    with pf.timer("fsync"), self.path.open("ab") as file:
+      os.fsync(file.fileno())
+
+  def stop(self, last=None):
+    if self.isClosed:
+      return
+    self.isClosed = True
+    if last is not None:
+      self.queue.put(last)
+    self.queue.put(CLOSE)
+    self.thread.join()
+    pf.count("records", self.countRecord)
+
+  # lastはキューに残ったグループをすべて書いた後、最後のレコードとして書く
+  def close(self, last=None):
+    if self.isClosed:
+      return
+    self.stop(last)
+    if self.error is not None:
+      raise self.error
+    if self.syncPolicy == "close":
+      self.sync()
@@ -0,0 +1,54 @@
+import pathlib
+
+import numpy as np
+
+import utility as u
+
+
+def saveState(path, datas, groups):
+  members = [i for group in groups for i, _ in group]
+  diffs = [np.nan if diff is None else diff for group in groups for _, diff in group]
+  offsets = np.cumsum([0, *[len(group) for group in groups]])
+  paths = "\0".join(str(data["path"]) for data in datas).encode("utf_8")
+  with pathlib.Path(path).open("wb") as file:
+    np.savez(
+      file,
+      paths=np.frombuffer(paths, dtype=np.uint8),
+      sizes=np.array([data.get("size", -1) for data in datas], dtype=np.int64),
+      mtimes=np.array([data.get("mtime", -1) for data in datas], dtype=np.int64),
+      hashes=u.packPHashes(datas),
+      shapes=u.packShapes(datas),
+      offsets=offsets.astype(np.int64),
+      members=np.array(members, dtype=np.int64),
+      diffs=np.array(diffs, dtype=np.float64),
+    )
+
+
+def loadState(path):
+  path = pathlib.Path(path)
+  if not path.exists():
+    return [], []
+  with np.load(path) as file:
+    paths = file["paths"].tobytes().decode("utf_8").split("\0") if len(file["paths"]) > 0 else []
+    sizes = file["sizes"].tolist()
+    mtimes = file["mtimes"].tolist()
+    hashes = file["hashes"]
+    shapes = file["shapes"]
+    offsets = file["offsets"].tolist()
+    members = file["members"].tolist()
+    diffs = file["diffs"].tolist()
+  datas = [
+    {
+      "path": pathlib.Path(p),
+      "size": sizes[i],
+      "mtime": mtimes[i],
+      "pHash": hashes[i : i + 1].view(np.uint8).reshape(1, -1),
+      "shape": u.unpackShape(shapes[i]),
+    }
+    for i, p in enumerate(paths)
+  ]
+  groups = [
+    [(members[k], None if np.isnan(diffs[k]) else diffs[k]) for k in range(start, end)]
+    for start, end in zip(offsets[:-1], offsets[1:], strict=True)
+  ]
+  return datas, groups
@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+import utility as u
+
+
+def toBgr(image):
+  if image.ndim == 2:
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+  if image.shape[2] == 4:
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+  return image
+
+
+def toGray(image):
+  if image.ndim == 2:
+    return image
+  return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+
+
+# ColorMomentHashはチャンネルごとのHuモーメント7個×6。桁が大きく違うので、
+# matchShapesと同様に対数をとり、符号の安定した先頭4個だけを使う
+def colorMoment(image):
+  moments = cv2.img_hash.colorMomentHash(toBgr(image)).reshape(6, 7)[:, :4]
+  return (-np.sign(moments) * np.log10(np.abs(moments) + 1e-30)).reshape(1, -1)
+
+
+def dHash(image):
+  gray = cv2.resize(toGray(image), (9, 8), interpolation=cv2.INTER_AREA)
+  return np.packbits(gray[:, 1:] > gray[:, :-1]).reshape(1, -1)
+
+
+# name: (計算, 距離の種類, 既定の上限)
+HASHES = {
+  "aHash": (cv2.img_hash.averageHash, "hamming", 10.0),
+  "dHash": (dHash, "hamming", 16.0),
+  "blockMean": (cv2.img_hash.blockMeanHash, "hamming", 48.0),
+  "colorMoment": (colorMoment, "l2", 3.0),
+  "marrHildreth": (cv2.img_hash.marrHildrethHash, "hamming", 180.0),
+}
+
+
+def getHashNames():
+  return list(HASHES)
+
+
+# "colorMoment:6.5"のように上限を指定する。省略時は既定値
+def parseBounds(specs):
+  bounds = {}
+  for spec in specs:
+    name, _, bound = spec.partition(":")
+    if name not in HASHES:
+      msg = f"unknown hash: {name} (choose from {', '.join(HASHES)})"
+      raise ValueError(msg)
+    bounds[name] = float(bound) if bound else HASHES[name][2]
+  return bounds
+
+
+def compute(image, names):
+  return {name: HASHES[name][0](image) for name in names}
+
+
+def packHashes(lt, names):
+  packed = {}
+  for name in names:
+    hashes = np.vstack([data["hashes"][name] for data in lt]) if len(lt) > 0 else np.empty((0, 8), np.uint8)
+    packed[name] = np.ascontiguousarray(hashes).view(np.uint64) if HASHES[name][1] == "hamming" else hashes
+  return packed
+
+
+def getDistances(name, x, hashes):
+  if HASHES[name][1] == "hamming":
+    return u.countBits(hashes ^ x).sum(axis=-1)
+  return np.linalg.norm(hashes - x, axis=-1)
+
+
+# すべてのハッシュが上限以内の候補だけを残す
+def getMask(targetHashes, i, hashes, indices, bounds):
+  mask = np.ones(len(indices), dtype=bool)
+  for name, bound in bounds.items():
+    mask &= getDistances(name, targetHashes[name][i], hashes[name][indices]) <= bound
+  return mask
@@ -0,0 +1,123 @@
+import itertools
+
+import numpy as np
+
+import utility as u
+
+
+class LinearIndex:
+  def __init__(self, hashes, threshold):
+    self.hashes = hashes
+    self.threshold = threshold
+
+  def query(self, x, threshold=None):
+    threshold = self.threshold if threshold is None else threshold
+    diffs = u.hammingDistances(x, self.hashes)
+    indices = np.flatnonzero(diffs <= threshold)
+    return indices, diffs[indices]
+
+
+class BKTree:
+  def __init__(self, hashes, threshold):
+    self.hashes = hashes
+    self.threshold = threshold
+    self.root = None
+    for i, x in enumerate(hashes.tolist()):
+      self.add(i, x)
+
+  def add(self, i, x):
+    node = [i, x, {}]
+    if self.root is None:
+      self.root = node
+      return
+    current = self.root
+    while True:
+      d = (current[1] ^ x).bit_count()
+      child = current[2].get(d)
+      if child is None:
+        current[2][d] = node
+        return
+      current = child
+
+  def query(self, x, threshold=None):
+    threshold = self.threshold if threshold is None else threshold
+    if self.root is None:
+      return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint8)
+    x = int(x)
+    indices = []
+    diffs = []
+    stack = [self.root]
+    while len(stack) > 0:
+      i, value, children = stack.pop()
+      d = (value ^ x).bit_count()
+      if d <= threshold:
+        indices.append(i)
+        diffs.append(d)
+      stack.extend(child for k, child in children.items() if d - threshold <= k <= d + threshold)
+    order = np.argsort(indices)
+    return np.asarray(indices, dtype=np.intp)[order], np.asarray(diffs, dtype=np.uint8)[order]
+
+
+# 64bitをm個に分けると、距離threshold以内の組はどれかの部分がthreshold // m以内で一致する
+class MultiIndexHash:
+  def __init__(self, hashes, threshold, maxChunks=8):
+    self.hashes = hashes
+    self.threshold = threshold
+    self.countChunk = max(1, min(int(threshold) + 1, maxChunks))
+    self.radius = int(threshold) // self.countChunk
+    widths = [64 // self.countChunk + (1 if i < 64 % self.countChunk else 0) for i in range(self.countChunk)]
+    self.chunks = []
+    shift = 0
+    for width in widths:
+      keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+      order = np.argsort(keys, kind="stable")
+      values, starts = np.unique(keys[order], return_index=True)
+      buckets = dict(zip(values.tolist(), np.split(order, starts[1:]) if len(order) > 0 else [], strict=True))
+      self.chunks.append((shift, width, buckets))
+      shift += width
+
+  def getNeighborKeys(self, key, width):
+    result = [key]
+    for r in range(1, self.radius + 1):
+      for bits in itertools.combinations(range(width), r):
+        flip = 0
+        for b in bits:
+          flip |= 1 << b
+        result.append(key ^ flip)
+    return result
+
+  def getCandidates(self, x):
+    x = int(x)
+    candidates = []
+    for shift, width, buckets in self.chunks:
+      key = (x >> shift) & ((1 << width) - 1)
+      for k in self.getNeighborKeys(key, width):
+        bucket = buckets.get(k)
+        if bucket is not None:
+          candidates.append(bucket)
+    if len(candidates) == 0:
+      return np.empty(0, dtype=np.intp)
+    return np.unique(np.concatenate(candidates))
+
+  def query(self, x, threshold=None):
+    threshold = self.threshold if threshold is None else threshold
+    if threshold > self.threshold:
+      return LinearIndex(self.hashes, threshold).query(x)
+    candidates = self.getCandidates(x)
+    diffs = u.hammingDistances(x, self.hashes[candidates])
+    mask = diffs <= threshold
+    return candidates[mask], diffs[mask]
+
+
+def getIndexNames():
+  return ["linear", "bktree", "mih"]
+
+
+def createIndex(name, hashes, threshold):
+  match name:
+    case "linear":
+      return LinearIndex(hashes, threshold)
+    case "bktree":
+      return BKTree(hashes, threshold)
+    case "mih":
+      return MultiIndexHash(hashes, threshold)
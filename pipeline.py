@@ -0,0 +1,115 @@
+import queue
+import threading
+
+import numpy as np
+
+import phashIndex as phi
+import utility as u
+
+STOP = None
+
+
+# 走査の例外はerrorsに入れ、streamの呼び出し側で投げ直す
+def walk(path, extensions, pathQueue, dirs, countWorker, errors):
+  try:
+    for data in u.iterFiles(path, isRecurse=True, extensions=extensions, dirs=dirs):
+      pathQueue.put(data)
+  except Exception as e:  # noqa: BLE001
+    errors.append(e)
+  finally:
+    for _ in range(countWorker):
+      pathQueue.put(STOP)
+
+
+# funcは(success, data)を返す。例外は失敗として返し、残りの取り出しを続ける
+def work(func, pathQueue, resultQueue):
+  try:
+    while (data := pathQueue.get()) is not STOP:
+      try:
+        result = func(data)
+      except Exception:  # noqa: BLE001
+        result = (False, data)
+      resultQueue.put(result)
+  finally:
+    resultQueue.put(STOP)
+
+
+def stream(path, extensions, func, dirs, countWorker=4, queueSize=256):
+  pathQueue = queue.Queue(queueSize)
+  resultQueue = queue.Queue(queueSize)
+  errors = []
+  threads = [threading.Thread(target=walk, args=(path, extensions, pathQueue, dirs, countWorker, errors), daemon=True)]
+  threads.extend(
+    threading.Thread(target=work, args=(func, pathQueue, resultQueue), daemon=True) for _ in range(countWorker)
+  )
+  for thread in threads:
+    thread.start()
+  remain = countWorker
+  while remain > 0:
+    result = resultQueue.get()
+    if result is STOP:
+      remain -= 1
+      continue
+    yield result
+  for thread in threads:
+    thread.join()
+  if len(errors) > 0:
+    raise errors[0]
+
+
+class IncrementalMatcher:
+  def __init__(self, threshold, diffRatio=0.2, capacity=1024):
+    self.threshold = threshold
+    self.diffRatio = diffRatio
+    self.hashes = np.empty(capacity, dtype=np.uint64)
+    self.ratios = np.empty(capacity, dtype=np.float64)
+    self.groups = []
+
+  def append(self, x, ratio, data):
+    count = len(self.groups)
+    if count == len(self.hashes):
+      self.hashes = np.resize(self.hashes, count * 2)
+      self.ratios = np.resize(self.ratios, count * 2)
+    self.hashes[count] = x
+    self.ratios[count] = ratio
+    data["target"] = True
+    self.groups.append([data])
+
+  def add(self, data):
+    x = u.packPHashes([data])[0]
+    ratio = u.getRatios([data])[0]
+    count = len(self.groups)
+    mask, diffs = u.getSameMask(x, ratio, self.hashes[:count], self.ratios[:count], self.threshold, self.diffRatio)
+    indices = np.flatnonzero(mask)
+    if len(indices) == 0:
+      self.append(x, ratio, data)
+      return None
+    i = indices[np.argmin(diffs[indices])]
+    data["diff"] = float(diffs[i])
+    self.groups[i].append(data)
+    return self.groups[i]
+
+  def getGroups(self):
+    return [group for group in self.groups if len(group) > 1]
+
+
+class TargetMatcher:
+  def __init__(self, others, threshold, indexName="linear", diffRatio=0.2):
+    self.others = others
+    self.ratios = u.getRatios(others)
+    self.index = phi.createIndex(indexName, u.packPHashes(others), threshold)
+    self.alive = np.ones(len(others), dtype=bool)
+    self.diffRatio = diffRatio
+
+  def match(self, data):
+    indices, diffs = self.index.query(u.packPHashes([data])[0])
+    mask = self.alive[indices] & (np.abs(self.ratios[indices] - u.getRatios([data])[0]) <= self.diffRatio)
+    indices, diffs = indices[mask], diffs[mask]
+    self.alive[indices] = False
+    data["target"] = True
+    sames = [data]
+    for j, diff in zip(indices, diffs, strict=True):
+      other = self.others[j]
+      other["diff"] = float(diff)
+      sames.append(other)
+    return sames
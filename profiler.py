@@ -0,0 +1,147 @@
+import collections
+import contextlib
+import cProfile
+import json
+import math
+import os
+import pathlib
+import threading
+import time
+from multiprocessing import util
+
+
+class Profiler:
+  def __init__(self, path=None, *, isCProfile=False):
+    self.path = None if path is None else pathlib.Path(path)
+    self.isEnabled = path is not None
+    self.isCProfile = isCProfile
+    self.lock = threading.Lock()
+    self.stages = {}
+    self.counters = collections.Counter()
+    self.histograms = {}
+    self.cProfile = None
+    self.start = time.time()
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    if not self.isEnabled:
+      yield
+      return
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+      yield
+    finally:
+      wall = time.perf_counter() - wall
+      cpu = time.process_time() - cpu
+      with self.lock:
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "count": 0})
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+        stage["count"] += 1
+
+  @contextlib.contextmanager
+  def timer(self, name):
+    if not self.isEnabled:
+      yield
+      return
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(name, time.perf_counter() - start)
+
+  def count(self, name, n=1):
+    if self.isEnabled:
+      with self.lock:
+        self.counters[name] += n
+
+  # 1us単位のlog2バケット
+  def observe(self, name, seconds):
+    bucket = max(0, math.ceil(math.log2(max(seconds * 1e6, 1.0))))
+    with self.lock:
+      histogram = self.histograms.setdefault(
+        name,
+        {"count": 0, "sum": 0.0, "max": 0.0, "buckets": collections.Counter()},
+      )
+      histogram["count"] += 1
+      histogram["sum"] += seconds
+      histogram["max"] = max(histogram["max"], seconds)
+      histogram["buckets"][bucket] += 1
+
+  def startCProfile(self, name="main"):
+    if not self.isCProfile or self.path is None:
+      return
+    self.cProfile = cProfile.Profile()
+    self.cProfile.enable()
+    util.Finalize(self, self.dumpCProfile, args=(name,), exitpriority=10)
+
+  def dumpCProfile(self, name="main"):
+    if self.cProfile is None:
+      return
+    self.cProfile.disable()
+    self.cProfile.dump_stats(f"{self.path}.{name}.{os.getpid()}.prof")
+    self.cProfile = None
+
+  def getRecords(self):
+    records = [{"type": "run", "start": self.start, "pid": os.getpid()}]
+    records.extend({"type": "stage", "name": k, **v} for k, v in self.stages.items())
+    records.extend({"type": "counter", "name": k, "value": v} for k, v in self.counters.items())
+    for k, v in self.histograms.items():
+      buckets = {f"<={2**b}us": v["buckets"][b] for b in sorted(v["buckets"])}
+      records.append(
+        {"type": "histogram", "name": k, "count": v["count"], "sum": v["sum"], "max": v["max"], "buckets": buckets},
+      )
+    return records
+
+  # ワーカープロセスからも追記するので1回のwriteで書く
+  def write(self):
+    if not self.isEnabled:
+      return
+    self.dumpCProfile()
+    with self.path.open("a", encoding="utf_8") as file:
+      file.write("".join(json.dumps(record) + "\n" for record in self.getRecords()))
+
+  def writeAtExit(self):
+    util.Finalize(self, self.write, exitpriority=5)
+
+
+# 端末への出力が律速しないように間引いて表示する
+class ProgressPrinter:
+  def __init__(self, interval=0.1):
+    self.interval = interval
+    self.last = 0.0
+    self.text = None
+
+  def __call__(self, text):
+    self.text = text
+    now = time.perf_counter()
+    if now - self.last >= self.interval:
+      self.last = now
+      print(f"\r\x1b[1M{text}", end="", flush=True)
+
+  def flush(self):
+    if self.text is not None:
+      print(f"\r\x1b[1M{self.text}", end="", flush=True)
+      self.text = None
+
+
+current = Profiler()
+
+
+def configure(path=None, *, isCProfile=False):
+  global current  # noqa: PLW0603
+  current = Profiler(path, isCProfile=isCProfile)
+  return current
+
+
+def stage(name):
+  return current.stage(name)
+
+
+def timer(name):
+  return current.timer(name)
+
+
+def count(name, n=1):
+  current.count(name, n)
@@ -1,6 +1,7 @@
 import argparse
 import pathlib
 
+import groupFile as gf
 import Utility as U
 
 
@@ -18,12 +19,21 @@ def printSameImagePickle(path, sortKey="path", *, isVerbose=False):
     print(f'"{path}" does not exist.')
     return
 
-  pm = U.PickleManager(path)
-  data = pm.loadExternal()
-  directory = data.pop(0)
-  target = data.pop(0)
-  extensions = data.pop(0)
-  dirs = data.pop()
+  if gf.isGroupFile(path):
+    data = gf.GroupFile(path)
+    directory = data.directory
+    target = data.targetPath
+    extensions = data.extensions
+    dirs = data.getDirs()
+    total = data.countFile()
+  else:
+    pm = U.PickleManager(path)
+    data = pm.loadExternal()
+    directory = data.pop(0)
+    target = data.pop(0)
+    extensions = data.pop(0)
+    dirs = data.pop()
+    total = sum(map(len, data))
 
   print(f"directory:   {directory}")
   print(f"target:      {target}")
@@ -39,7 +49,7 @@ def printSameImagePickle(path, sortKey="path", *, isVerbose=False):
   for k, v in dt:
     print(f"{v['sames']:{wt}} / {v['total']:{ws}}: {U.subPath(k, directory)}")
   print(f"same images: {len(data)}")
-  print(f"total:       {sum(map(len, data))}")
+  print(f"total:       {total}")
 
   if isVerbose:
     for lt in data:
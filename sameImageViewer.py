@@ -1,19 +1,20 @@
 import argparse
 import concurrent.futures as cf
-import functools
 import operator
 import shutil
 import sys
+import threading
 import tkinter as tk
+from collections import OrderedDict
 from pathlib import Path
 from tkinter import ttk
 
-import Decorator as D
-import ImageUtility as IU
 import WindowsApi as WinApi
-from PIL import Image, ImageTk
+from PIL import ImageTk
 
+import groupFile as gf
 import imageDiffViewer
+import thumbnailCache as tn
 import Utility as U
 import utility as u
 
@@ -229,11 +230,12 @@ class FrameCommand(ttk.Frame):
 
 
 class CanvasWindow(tk.Canvas):
-  def __init__(self, master, width, height):
+  def __init__(self, master, width, height, thumbnailCache=None):
     super().__init__(master, highlightthickness=0)
     self.width = width
     self.height = height
     self.executor = cf.ThreadPoolExecutor()
+    self.thumbnailCache = thumbnailCache
 
     self.frameWindow = ttk.Frame(self)
     self.configure(scrollregion=(0, 0, 0, height))
@@ -278,9 +280,9 @@ class CanvasWindow(tk.Canvas):
   def openImage(self, data):
     if not data["path"].exists():
       return None
-    image = Image.open(data["path"])
-    image.load()
-    return IU.resizeImage(image, *self.thumbnailSize)
+    if self.thumbnailCache is None:
+      return tn.createThumbnail(data["path"], tuple(self.thumbnailSize))
+    return self.thumbnailCache.open(data["path"], tuple(self.thumbnailSize))
 
   def openImages(self, data):
     return list(self.executor.map(self.openImage, data, timeout=30))
@@ -379,10 +381,69 @@ class CanvasWindow(tk.Canvas):
         self.setTarget(checkValue, indexData, index)
 
 
+class GroupLoader:
+  def __init__(self, dumpFile, cacheSize=32):
+    self.cacheSize = cacheSize
+    self.cache = OrderedDict()
+    self.modified = {}
+    self.lock = threading.Lock()
+    self.groupFile = None
+    self.pm = None
+    if gf.isGroupFile(dumpFile):
+      self.groupFile = gf.GroupFile(dumpFile)
+      self.directory = self.groupFile.directory
+      self.targetPath = self.groupFile.targetPath
+      self.extensions = self.groupFile.extensions
+      self.dirs = self.groupFile.getDirs()
+      self.count = len(self.groupFile)
+      self.maxImage = int(self.groupFile.getGroupSizes().max()) if self.count > 0 else 0
+      self.countFile = self.groupFile.countFile()
+    else:
+      self.pm = U.PickleManager(dumpFile)
+      count = self.pm.countExternal()
+      self.directory = self.pm.load(0)
+      self.targetPath = self.pm.load(1)
+      self.extensions = self.pm.load(2)
+      self.dirs = self.pm.load(count - 1)
+      self.count = count - 4
+      self.maxImage = None  # 全グループを読まないと分からない
+      self.countFile = sum(v["sames"] for v in self.dirs.values())
+
+  def __len__(self):
+    return self.count
+
+  def load(self, i):
+    lt = self.groupFile[i] if self.groupFile is not None else self.pm.load(i + 3)
+    lt = [dt for dt in lt if dt["path"].exists()]
+    return U.naturalSorted(lt, key=lambda dt: dt["path"])
+
+  def __getitem__(self, i):
+    if i in self.modified:
+      return self.modified[i]
+    with self.lock:
+      if i in self.cache:
+        self.cache.move_to_end(i)
+        return self.cache[i]
+    lt = self.load(i)
+    with self.lock:
+      self.cache[i] = lt
+      while len(self.cache) > self.cacheSize:
+        self.cache.popitem(last=False)
+    return lt
+
+  def __setitem__(self, i, lt):  # 変更したグループはキャッシュから消さない
+    self.modified[i] = lt
+
+  def prefetch(self, i):
+    if 0 <= i < self.count:
+      self[i]
+
+
 class SameImageViewer(ttk.Frame):
-  def __init__(self, dumpFilePath, outputPath, recordPath, master=None):
+  def __init__(self, dumpFilePath, outputPath, recordPath, master=None, thumbnailCache=None):
     super().__init__(master)
     self.dumpFile = dumpFilePath
+    self.thumbnailCache = thumbnailCache
     self.destination = outputPath.absolute()
     self.recordPath = recordPath.absolute()
     self.pm = None
@@ -403,7 +464,7 @@ class SameImageViewer(ttk.Frame):
       self.master.destroy()
       return
 
-    self.current = 0
+    self.current = self.findGroup(-1, 1)
     self.countImage = 0
     self.oldCountImage = -1
     self.isAutoSize = True
@@ -451,6 +512,7 @@ class SameImageViewer(ttk.Frame):
       self,
       width=self.resolution[0] - 20,
       height=self.resolution[1] - (frameCommandHeight + titleBarHeight),
+      thumbnailCache=self.thumbnailCache,
     )
     self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvasWindow.yview)
     self.canvasWindow.configure(yscrollcommand=self.scrollbar.set)
@@ -632,39 +694,25 @@ class SameImageViewer(ttk.Frame):
       self.master.wm_overrideredirect(True)
 
   def load(self):
-    self.pm = U.PickleManager(self.dumpFile)
-    data = self.pm.loadExternal()
-    self.directory = data[0]
-    self.targetPath = data[1]
-    self.extensions = data[2]
-    self.dirs = data[-1]
-    self.data = data[3:-1]
+    self.data = GroupLoader(self.dumpFile)
+    self.directory = self.data.directory
+    self.targetPath = self.data.targetPath
+    self.extensions = self.data.extensions
+    self.dirs = self.data.dirs
     self.countData = len(self.data)
     if self.countData == 0:
       return
     self.countDataWidth = len(str(self.countData))
-    maxImage = functools.reduce(max, map(len, self.data))
-    self.maxImageWidth = len(str(maxImage))
+    self.maxImageWidth = len(str(self.data.maxImage if self.data.maxImage is not None else self.data.countFile))
+    self.countFileWidth = len(str(self.data.countFile))
     self.destination.mkdir(exist_ok=True)
-    self.checkData()
-
-  def deleteNotExists(self, args):
-    i, lt = args
-    for dt in lt[:]:
-      if not dt["path"].exists():
-        self.data[i].remove(dt)
-    self.data[i] = U.naturalSorted(lt, key=lambda dt: dt["path"])
-
-  @D.printFuncInfo()
-  def checkData(self):
-    results = self.executor.map(self.deleteNotExists, enumerate(self.data), timeout=60)
-    list(results)
-    self.data = [lt for lt in self.data if len(lt) > 1]
-    self.data = U.naturalSorted(self.data)
-    self.countData = len(self.data)
-    self.countDataWidth = len(str(self.countData))
-    self.countFile = sum(map(len, self.data))
-    self.countFileWidth = len(str(self.countFile))
+
+  def findGroup(self, i, step):
+    for _ in range(self.countData):
+      i = (i + step) % self.countData
+      if len(self.data[i]) > 1:
+        return i
+    return i
 
   def draw(self, i, *, isAutoSize=False):
     self.canvasWindow.deleteAllWidgets()
@@ -682,6 +730,7 @@ class SameImageViewer(ttk.Frame):
     self.updateRecordCount()
     self.canvasWindow.expandArea()
     self.canvasWindow.createAllCanvas(self.data[i], i)
+    self.executor.submit(self.data.prefetch, (i + 1) % self.countData)
 
   def perform(self):
     self.canvasWindow.deleteWidgets()
@@ -715,19 +764,13 @@ class SameImageViewer(ttk.Frame):
   def next(self):
     if self.countData < 1:
       return
-    if self.current < self.countData - 1:
-      self.current += 1
-    else:
-      self.current = 0
+    self.current = self.findGroup(self.current, 1)
     self.executor.submit(self.draw, self.current, isAutoSize=True)
 
   def previous(self):
     if self.countData < 1:
       return
-    if self.current > 0:
-      self.current -= 1
-    else:
-      self.current = self.countData - 1
+    self.current = self.findGroup(self.current, -1)
     self.executor.submit(self.draw, self.current, isAutoSize=True)
 
   def updateTargetCount(self):
@@ -826,23 +869,32 @@ def argumentParser():
   parser.add_argument("dumpFile", type=Path)
   parser.add_argument("-o", "--outputPath", type=Path)
   parser.add_argument("-r", "--recordPath", type=Path)
+  parser.add_argument("-t", "--thumbnailCache", type=Path, default=tn.DEFAULT_DIRECTORY)
+  parser.add_argument("--thumbnailCacheSize", type=int, default=1024, metavar="MiB")
+  parser.add_argument("--noThumbnailCache", action="store_true")
   args = parser.parse_args()
   dumpFilePath = args.dumpFile.absolute()
   if not dumpFilePath.exists():
     print(f'"{dumpFilePath}" does not exist.')
     sys.exit()
-  pm = U.PickleManager(dumpFilePath)
-  pm.countExternal()
-  directory = pm.load(0)
+  if gf.isGroupFile(dumpFilePath):
+    directory = gf.GroupFile(dumpFilePath).directory
+  else:
+    pm = U.PickleManager(dumpFilePath)
+    pm.countExternal()
+    directory = pm.load(0)
   outputPath = Path(directory, "output") if args.outputPath is None else args.outputPath
   recordPath = Path(directory, r"output\record.txt") if args.recordPath is None else args.recordPath
-  return dumpFilePath, outputPath, recordPath
+  thumbnailCache = None
+  if not args.noThumbnailCache:
+    thumbnailCache = tn.ThumbnailCache(args.thumbnailCache, args.thumbnailCacheSize * 2**20)
+  return dumpFilePath, outputPath, recordPath, thumbnailCache
 
 
 if __name__ == "__main__":
-  dumpFilePath, outputPath, recordPath = argumentParser()
+  dumpFilePath, outputPath, recordPath, thumbnailCache = argumentParser()
   print(f'dumpFilePath: "{dumpFilePath}"\noutputPath:   "{outputPath}"\nrecordPath:   "{recordPath}"')
-  gui = SameImageViewer(dumpFilePath, outputPath, recordPath)
+  gui = SameImageViewer(dumpFilePath, outputPath, recordPath, thumbnailCache=thumbnailCache)
   gui.mainloop()
   if len(gui.record) > 1:
     gui.writeRecord()
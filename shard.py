@@ -0,0 +1,316 @@
+import argparse
+import collections
+import concurrent.futures as cf
+import hashlib
+import pathlib
+import sys
+import threading
+import time
+from multiprocessing import connection
+
+import numpy as np
+
+import cluster as cl
+import dumpSameImages as dsi
+import groupWriter as gw
+import phashIndex as phi
+import Utility as U
+import utility as u
+
+
+def getShard(path, countShard):
+  digest = hashlib.blake2b(str(path).encode("utf_8"), digest_size=8).digest()
+  return int.from_bytes(digest, "little") % countShard
+
+
+def encodePaths(paths):
+  return np.frombuffer("\0".join(str(x) for x in paths).encode("utf_8"), dtype=np.uint8)
+
+
+def decodePaths(array):
+  return [pathlib.Path(x) for x in array.tobytes().decode("utf_8").split("\0")] if len(array) > 0 else []
+
+
+# ディレクトリ単位で振り分けるので、dirsのtotalもシャードごとに重ならない
+# fileListでは1つのディレクトリが複数のリストに分かれうるので、
+# totalはmergeで足し合わせる
+def getFiles(path, extensions, shard, countShard, fileList=None):
+  if fileList is not None:
+    with pathlib.Path(fileList).open(encoding="utf_8") as file:
+      datas = [{"path": pathlib.Path(line.rstrip("\n")).absolute()} for line in file if line.strip()]
+    dirs = {}
+    for data in datas:
+      dirs.setdefault(data["path"].parent, {"total": 0, "sames": 0})["total"] += 1
+    return datas, dirs
+  datas, dirs = u.getFiles(path, isRecurse=True, extensions=extensions)
+  dirs = {k: v for k, v in dirs.items() if getShard(k, countShard) == shard}
+  return [data for data in datas if data["path"].parent in dirs], dirs
+
+
+def extract(path, extensions, shard, countShard, fileList=None, workers=None, *, isReduced=False):
+  datas, dirs = getFiles(path, extensions, shard, countShard, fileList)
+  fails = []
+  with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+    dsi.setInfoAll(datas, ex, fails, None, isReduced=isReduced)
+  return {
+    "paths": encodePaths(data["path"] for data in datas),
+    "hashes": u.packPHashes(datas),
+    "shapes": u.packShapes(datas),
+    "fails": encodePaths(fails),
+    "dirPaths": encodePaths(dirs),
+    "dirTotals": np.array([v["total"] for v in dirs.values()], dtype=np.int64),
+  }
+
+
+def saveFeatures(path, arrays):
+  with pathlib.Path(path).open("wb") as file:
+    np.savez(file, **arrays)
+
+
+def loadFeatures(path):
+  with np.load(path) as file:
+    hashes = file["hashes"]
+    shapes = file["shapes"]
+    datas = [
+      {"path": p, "pHash": hashes[i : i + 1].view(np.uint8).reshape(1, -1), "shape": u.unpackShape(shapes[i])}
+      for i, p in enumerate(decodePaths(file["paths"]))
+    ]
+    fails = decodePaths(file["fails"])
+    dirPaths = decodePaths(file["dirPaths"])
+    dirs = {p: {"total": t, "sames": 0} for p, t in zip(dirPaths, file["dirTotals"].tolist(), strict=True)}
+  return datas, fails, dirs
+
+
+# 全シャードの特徴量を集めて1つのインデックスで比較する。出力は通常と同じ形式
+def merge(featurePaths, pickleOutput, failedPath, path, extensions, threshold, index="linear", clustering="greedy"):
+  datas, fails, dirs = [], [], {}
+  for featurePath in featurePaths:
+    shardDatas, shardFails, shardDirs = loadFeatures(featurePath)
+    datas.extend(shardDatas)
+    fails.extend(shardFails)
+    for directory, v in shardDirs.items():
+      dirs.setdefault(directory, {"total": 0, "sames": 0})["total"] += v["total"]
+  datas.sort(key=lambda x: x["path"])
+  print(f"merged: {len(featurePaths)} shards, {len(datas)} images, {len(fails)} fails")
+  pm = U.PickleManager(pickleOutput)
+  pm.dump(path)
+  pm.dump(None)
+  pm.dump(extensions)
+  with gw.GroupWriter(pm, pickleOutput) as writer:
+    if clustering == "greedy":
+      dsi.dumpSamesPHash(datas, datas, threshold, dirs, writer, index)
+    else:
+      edges = dsi.getEdgesPHash(datas, datas, threshold, index)
+      dsi.dumpClusters(datas, datas, edges, clustering, dirs, writer)
+    writer.close(dirs)
+  dsi.progress.flush()
+  print()
+  dsi.writeFails(fails, failedPath)
+
+
+class Coordinator:
+  def __init__(self, countShard, params):
+    self.params = params
+    self.pending = collections.deque(range(countShard))
+    self.running = set()
+    self.results = {}
+    self.countShard = countShard
+    self.condition = threading.Condition()
+
+  def next(self):
+    with self.condition:
+      if len(self.pending) > 0:
+        shard = self.pending.popleft()
+        self.running.add(shard)
+        return shard
+      return None if len(self.running) == 0 else -1
+
+  def done(self, shard, arrays):
+    with self.condition:
+      self.running.discard(shard)
+      self.results[shard] = arrays
+      self.condition.notify_all()
+
+  # 処理中に切断されたワーカーのシャードは他のワーカーに回す
+  def abandon(self, shard):
+    with self.condition:
+      if shard in self.running:
+        self.running.discard(shard)
+        self.pending.append(shard)
+
+  def handle(self, conn):
+    shard = None
+    try:
+      while True:
+        message = conn.recv()
+        if message[0] == "done":
+          self.done(message[1], message[2])
+          shard = None
+          continue
+        shard = self.next()
+        if shard is None:
+          conn.send(("stop",))
+          return
+        conn.send(("wait",) if shard < 0 else ("shard", shard, self.countShard, self.params))
+    except (EOFError, OSError):
+      pass
+    finally:
+      if shard is not None and shard >= 0:
+        self.abandon(shard)
+      conn.close()
+
+  def wait(self):
+    with self.condition:
+      self.condition.wait_for(lambda: len(self.results) == self.countShard)
+
+
+def serve(address, authkey, countShard, params, workDir):
+  coordinator = Coordinator(countShard, params)
+  listener = connection.Listener(address, authkey=authkey)
+
+  def accept():
+    while True:
+      try:
+        conn = listener.accept()
+      except (connection.AuthenticationError, OSError) as e:
+        print(f"rejected: {e}")
+        continue
+      threading.Thread(target=coordinator.handle, args=(conn,), daemon=True).start()
+
+  threading.Thread(target=accept, daemon=True).start()
+  print(f"serving {countShard} shards on {listener.address}")
+  coordinator.wait()
+  featurePaths = []
+  for shard, arrays in sorted(coordinator.results.items()):
+    featurePath = pathlib.Path(workDir, f"shard_{shard}.npz")
+    saveFeatures(featurePath, arrays)
+    featurePaths.append(featurePath)
+  return featurePaths
+
+
+# 全シャードが揃うとコーディネーターは接続を切ってマージに移るので、
+# 切断も終了の合図として扱う
+def work(address, authkey, workers=None, interval=1.0):
+  with connection.Client(address, authkey=authkey) as conn:
+    while True:
+      try:
+        conn.send(("ready",))
+        message = conn.recv()
+      except (EOFError, ConnectionError):
+        return
+      if message[0] == "stop":
+        return
+      if message[0] == "wait":
+        time.sleep(interval)
+        continue
+      _, shard, countShard, params = message
+      print(f"shard {shard}/{countShard}")
+      arrays = extract(
+        params["path"],
+        params["extensions"],
+        shard,
+        countShard,
+        workers=workers,
+        isReduced=params["isReduced"],
+      )
+      conn.send(("done", shard, arrays))
+
+
+def parseAddress(text):
+  host, _, port = text.rpartition(":")
+  return host or "127.0.0.1", int(port)
+
+
+def argumentParser():
+  parser = argparse.ArgumentParser()
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  extractParser = subparsers.add_parser("extract")
+  extractParser.add_argument("path", type=pathlib.Path)
+  extractParser.add_argument("-o", "--outputPath", type=pathlib.Path, required=True)
+  extractParser.add_argument("--shard", type=int, default=0)
+  extractParser.add_argument("--countShard", type=int, default=1)
+  extractParser.add_argument("--fileList", type=pathlib.Path, default=None)
+
+  mergeParser = subparsers.add_parser("merge")
+  mergeParser.add_argument("path", type=pathlib.Path)
+  mergeParser.add_argument("featurePaths", type=pathlib.Path, nargs="+")
+
+  serveParser = subparsers.add_parser("serve")
+  serveParser.add_argument("path", type=pathlib.Path)
+  serveParser.add_argument("--countShard", type=int, required=True)
+  serveParser.add_argument("--workDir", type=pathlib.Path, default=None)
+
+  workParser = subparsers.add_parser("work")
+
+  for sub in [extractParser, mergeParser, serveParser]:
+    sub.add_argument("-e", "--extensions", nargs="*", default=[".jpg", ".png", ".webp", ".gif"])
+  for sub in [extractParser, serveParser, workParser]:
+    sub.add_argument("-w", "--workers", type=int, default=None)
+  for sub in [extractParser, serveParser]:
+    sub.add_argument("-r", "--reduced", action="store_true")
+  for sub in [mergeParser, serveParser]:
+    sub.add_argument("-p", "--picklePath", type=pathlib.Path, default=None)
+    sub.add_argument("-f", "--failedPath", type=pathlib.Path, default=None)
+    sub.add_argument("-th", "--threshold", type=float, default=4.0)
+    sub.add_argument("-i", "--index", choices=phi.getIndexNames(), default="linear")
+    sub.add_argument("-l", "--clustering", choices=["greedy", *cl.getLinkageNames()], default="greedy")
+  for sub in [serveParser, workParser]:
+    sub.add_argument("-a", "--address", type=parseAddress, default=("127.0.0.1", 6000))
+    sub.add_argument("-k", "--authkey", required=True)
+  args = parser.parse_args()
+  if hasattr(args, "path"):
+    args.path = args.path.absolute()
+    if not args.path.exists():
+      print(f'"{args.path}" does not exist.')
+      sys.exit()
+  if hasattr(args, "picklePath"):
+    if args.picklePath is None:
+      args.picklePath = pathlib.Path(args.path, f"pHash_{args.path.stem}.pkl")
+    if args.failedPath is None:
+      args.failedPath = pathlib.Path(args.path, f"failed_{args.path.stem}.pkl")
+  return args
+
+
+if __name__ == "__main__":
+  args = argumentParser()
+  match args.command:
+    case "extract":
+      arrays = extract(
+        args.path,
+        args.extensions,
+        args.shard,
+        args.countShard,
+        args.fileList,
+        args.workers,
+        isReduced=args.reduced,
+      )
+      saveFeatures(args.outputPath, arrays)
+      print(f'output: "{args.outputPath}"')
+    case "merge":
+      merge(
+        args.featurePaths,
+        args.picklePath,
+        args.failedPath,
+        args.path,
+        args.extensions,
+        args.threshold,
+        args.index,
+        args.clustering,
+      )
+    case "serve":
+      params = {"path": args.path, "extensions": args.extensions, "isReduced": args.reduced}
+      workDir = args.workDir if args.workDir is not None else args.picklePath.parent
+      featurePaths = serve(args.address, args.authkey.encode("utf_8"), args.countShard, params, workDir)
+      merge(
+        featurePaths,
+        args.picklePath,
+        args.failedPath,
+        args.path,
+        args.extensions,
+        args.threshold,
+        args.index,
+        args.clustering,
+      )
+    case "work":
+      work(args.address, args.authkey.encode("utf_8"), args.workers)
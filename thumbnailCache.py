@@ -0,0 +1,178 @@
+import collections
+import hashlib
+import os
+import pathlib
+import threading
+
+import ImageUtility as IU
+from PIL import Image
+
+DEFAULT_DIRECTORY = pathlib.Path(os.environ.get("LOCALAPPDATA", pathlib.Path.home() / ".cache"), "sameImageViewer")
+PNG_MODES = ["1", "L", "LA", "P", "RGB", "RGBA"]
+
+
+# 抽出側とビューア側で同じ画像になるように、サムネイルは必ずここで作る
+# JPEGはboxを下回らない範囲でDCTの段階で縮小して読む
+def createThumbnail(path, box):
+  image = Image.open(path)
+  image.draft(image.mode, box)
+  image.load()
+  return IU.resizeImage(image, *box)
+
+
+# サムネイルをpath, mtime, size, 枠の大きさをキーにPNGで保存し、
+# 最近使ったものはメモリにも残す
+# ディスクはmaxBytesを超えると、更新日時(ヒット時に更新する)の古い順に
+# maxBytesの9割まで消す
+class ThumbnailCache:
+  def __init__(self, directory=DEFAULT_DIRECTORY, maxBytes=2**30, memoryBytes=2**28):
+    self.directory = pathlib.Path(directory)
+    self.directory.mkdir(parents=True, exist_ok=True)
+    self.maxBytes = maxBytes
+    self.memoryBytes = memoryBytes
+    self.lock = threading.Lock()
+    self.evictLock = threading.Lock()
+    self.memory = collections.OrderedDict()
+    self.countMemoryByte = 0
+    self.countByte = sum(size for _, size, _ in self.getEntries())
+    self.countHit = 0
+    self.countMiss = 0
+
+  def scan(self):
+    for sub in os.scandir(self.directory):
+      if sub.is_dir():
+        yield from (entry for entry in os.scandir(sub.path) if entry.name.endswith(".png"))
+
+  # 他のスレッドやプロセスが消したファイルは飛ばす
+  def getEntries(self):
+    entries = []
+    for entry in self.scan():
+      try:
+        st = entry.stat()
+      except OSError:
+        continue
+      entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    return entries
+
+  def getKey(self, path, box):
+    try:
+      st = os.stat(path)
+    except OSError:
+      return None
+    text = f"{pathlib.Path(path).absolute()}\0{st.st_mtime_ns}\0{st.st_size}\0{box[0]}x{box[1]}"
+    return hashlib.blake2b(text.encode("utf_8"), digest_size=16).hexdigest()
+
+  def getPath(self, key):
+    return pathlib.Path(self.directory, key[:2], f"{key}.png")
+
+  # memoryBytesが0なら書き込み専用で、メモリには残さない
+  def remember(self, key, image):
+    if self.memoryBytes <= 0:
+      return
+    size = image.width * image.height * len(image.getbands())
+    with self.lock:
+      if key in self.memory:
+        return
+      self.memory[key] = (image, size)
+      self.countMemoryByte += size
+      while self.countMemoryByte > self.memoryBytes and len(self.memory) > 1:
+        _, (_, removed) = self.memory.popitem(last=False)
+        self.countMemoryByte -= removed
+
+  def get(self, path, box):
+    key = self.getKey(path, box)
+    if key is None:
+      return None
+    with self.lock:
+      if key in self.memory:
+        self.memory.move_to_end(key)
+        self.countHit += 1
+        return self.memory[key][0]
+    thumbnailPath = self.getPath(key)
+    try:
+      image = Image.open(thumbnailPath)
+      image.load()
+      os.utime(thumbnailPath)
+    except Exception:  # noqa: BLE001
+      with self.lock:
+        self.countMiss += 1
+      return None
+    with self.lock:
+      self.countHit += 1
+    self.remember(key, image)
+    return image
+
+  def contains(self, path, box):
+    key = self.getKey(path, box)
+    return key is not None and (key in self.memory or self.getPath(key).exists())
+
+  # 書きかけのファイルを読まないように、一時ファイルに書いてから置き換える
+  def save(self, key, image):
+    if image.mode not in PNG_MODES:
+      image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    output = self.getPath(key)
+    output.parent.mkdir(exist_ok=True)
+    temp = output.with_name(f"{key}.{threading.get_ident()}.tmp")
+    try:
+      image.save(temp, format="PNG", compress_level=1)
+      size = temp.stat().st_size
+      temp.replace(output)
+    finally:
+      temp.unlink(missing_ok=True)
+    return size
+
+  # キャッシュに書けなくても、抽出や表示は止めない
+  def put(self, path, box, image):
+    key = self.getKey(path, box)
+    if key is None:
+      return
+    try:
+      size = self.save(key, image)
+      self.remember(key, image)
+      with self.lock:
+        self.countByte += size
+        isOver = self.countByte > self.maxBytes
+      if isOver:
+        self.evict()
+    except Exception:  # noqa: BLE001
+      return
+
+  # 抽出中の事前生成用。読めない画像は飛ばす
+  def putFile(self, path, box):
+    if self.contains(path, box):
+      return
+    try:
+      thumbnail = createThumbnail(path, box)
+    except Exception:  # noqa: BLE001
+      return
+    self.put(path, box, thumbnail)
+
+  def open(self, path, box):
+    image = self.get(path, box)
+    if image is None:
+      image = createThumbnail(path, box)
+      self.put(path, box, image)
+    return image
+
+  # 同時に走らせても消す量は変わらないので、実行中なら他のスレッドは何もしない
+  def evict(self):
+    if not self.evictLock.acquire(blocking=False):
+      return 0
+    try:
+      entries = sorted(self.getEntries())
+      total = sum(size for _, size, _ in entries)
+      count = 0
+      for _, size, path in entries:
+        if total <= self.maxBytes * 0.9:
+          break
+        try:
+          os.remove(path)
+        except OSError:
+          continue
+        total -= size
+        count += 1
+      with self.lock:
+        self.countByte = total
+      return count
+    finally:
+      self.evictLock.release()
@@ -0,0 +1,125 @@
+import concurrent.futures as cf
+import os
+import pathlib
+
+import ImageUtility as IU
+import numpy as np
+
+import utility as u
+
+workerState = {}
+
+
+def initPHash(targetHashes, targetRatios, hashes, ratios, isSelf):
+  workerState.update(targetHashes=targetHashes, targetRatios=targetRatios, hashes=hashes, ratios=ratios, isSelf=isSelf)
+
+
+def comparePHashTile(tile, threshold, diffRatio):
+  r0, r1, c0, c1 = tile
+  targetHashes, targetRatios = workerState["targetHashes"], workerState["targetRatios"]
+  hashes, ratios = workerState["hashes"], workerState["ratios"]
+  diffs = u.hammingDistances(targetHashes[r0:r1, None], hashes[None, c0:c1])
+  mask = (diffs <= threshold) & (np.abs(targetRatios[r0:r1, None] - ratios[None, c0:c1]) <= diffRatio)
+  if workerState["isSelf"]:
+    mask &= np.arange(r0, r1)[:, None] < np.arange(c0, c1)[None, :]
+  i, j = np.nonzero(mask)
+  return i + r0, j + c0, diffs[i, j]
+
+
+def writeDescriptors(lt, path):
+  offsets = np.cumsum([0, *[len(data["descriptors"]) for data in lt]])
+  np.save(f"{path}_offset.npy", offsets)
+  np.save(f"{path}_descriptors.npy", np.concatenate([data["descriptors"] for data in lt]))
+
+
+def loadDescriptors(path):
+  return np.load(f"{path}_offset.npy"), np.load(f"{path}_descriptors.npy", mmap_mode="c")
+
+
+def initDescriptor(targetPath, targetRatios, otherPath, ratios, isSelf, matcherFactory):
+  workerState.update(
+    targets=loadDescriptors(targetPath),
+    targetRatios=targetRatios,
+    others=loadDescriptors(otherPath),
+    ratios=ratios,
+    isSelf=isSelf,
+    matcher=matcherFactory(),
+  )
+
+
+def compareDescriptorTile(tile, threshold, diffRatio):
+  r0, r1, c0, c1 = tile
+  targetOffsets, targetDescriptors = workerState["targets"]
+  offsets, descriptors = workerState["others"]
+  targetRatios, ratios = workerState["targetRatios"], workerState["ratios"]
+  matcher = workerState["matcher"]
+  rows, columns, diffs = [], [], []
+  for i in range(r0, r1):
+    target = u.toMatchable(targetDescriptors[targetOffsets[i] : targetOffsets[i + 1]])
+    for j in range(max(c0, i + 1) if workerState["isSelf"] else c0, c1):
+      if abs(targetRatios[i] - ratios[j]) > diffRatio:
+        continue
+      diff = IU.compareDescriptor(matcher, target, u.toMatchable(descriptors[offsets[j] : offsets[j + 1]]))
+      if diff is not None and diff <= threshold:
+        rows.append(i)
+        columns.append(j)
+        diffs.append(diff)
+  return np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp), np.asarray(diffs, dtype=np.float64)
+
+
+def getTiles(countRow, countColumn, tileSize, isSelf):
+  for r0 in range(0, countRow, tileSize):
+    for c0 in range(r0 if isSelf else 0, countColumn, tileSize):
+      yield r0, min(r0 + tileSize, countRow), c0, min(c0 + tileSize, countColumn)
+
+
+def toEdges(future):
+  rows, columns, diffs = future.result()
+  return zip(rows.tolist(), columns.tolist(), diffs.tolist(), strict=True)
+
+
+def compareTiles(
+  targets,
+  others,
+  threshold,
+  scratchDir,
+  matcherFactory=None,
+  workers=None,
+  tileSize=None,
+  maxInFlight=None,
+  diffRatio=0.2,
+):
+  if len(targets) == 0 or len(others) == 0:
+    return
+  isSelf = targets is others
+  ratios = u.getRatios(others)
+  targetRatios = ratios if isSelf else u.getRatios(targets)
+  if matcherFactory is None:
+    hashes = u.packPHashes(others)
+    targetHashes = hashes if isSelf else u.packPHashes(targets)
+    initializer, initargs = initPHash, (targetHashes, targetRatios, hashes, ratios, isSelf)
+    func = comparePHashTile
+    tileSize = 2048 if tileSize is None else tileSize
+  else:
+    otherPath = pathlib.Path(scratchDir, "tileOthers")
+    writeDescriptors(others, otherPath)
+    targetPath = otherPath
+    if not isSelf:
+      targetPath = pathlib.Path(scratchDir, "tileTargets")
+      writeDescriptors(targets, targetPath)
+    initializer, initargs = initDescriptor, (targetPath, targetRatios, otherPath, ratios, isSelf, matcherFactory)
+    func = compareDescriptorTile
+    tileSize = 64 if tileSize is None else tileSize
+  workers = os.cpu_count() if workers is None else workers
+  maxInFlight = workers * 2 if maxInFlight is None else maxInFlight
+
+  with cf.ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pex:
+    pending = set()
+    for tile in getTiles(len(targets), len(others), tileSize, isSelf):
+      if len(pending) >= maxInFlight:
+        done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+        for future in done:
+          yield from toEdges(future)
+      pending.add(pex.submit(func, tile, threshold, diffRatio))
+    for future in cf.as_completed(pending):
+      yield from toEdges(future)
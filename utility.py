@@ -1,12 +1,22 @@
+import concurrent.futures as cf
 import itertools
 import math
+import os
 import pathlib
-from collections import deque
 
+import cv2
 import ImageUtility as IU
+import numpy as np
+from PIL import Image
 
 import Utility as U
 
+REDUCED_FLAGS = [
+  (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+  (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+  (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+]
+
 
 def toGeometry(width, height, left, top):
   return f"{width}x{height}+{left}+{top}"
@@ -29,35 +39,159 @@ def checkFileName(path, sep="#", width=2, *, isMakeDir=False):
     i += 1
 
 
+def scanDirectory(path, extensions=None):
+  files = []
+  directories = []
+  with os.scandir(path) as entries:
+    for entry in entries:
+      if entry.is_file():
+        if extensions is not None and os.path.splitext(entry.name)[1] not in extensions:
+          continue
+        st = entry.stat()
+        files.append({"path": pathlib.Path(entry.path), "size": st.st_size, "mtime": st.st_mtime_ns})
+      elif entry.is_dir():
+        directories.append(pathlib.Path(entry.path))
+  return files, directories
+
+
+def iterFiles(path, isRecurse, extensions=None, dirs=None, workers=8):
+  path = pathlib.Path(path).absolute()
+  extensions = None if extensions is None else set(extensions)
+  dirs = {} if dirs is None else dirs
+  dirs[path] = {"total": 0, "sames": 0}
+  with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+    pending = {ex.submit(scanDirectory, path, extensions)}
+    while len(pending) > 0:
+      done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+      for future in done:
+        files, directories = future.result()
+        if isRecurse:
+          for directory in directories:
+            dirs[directory] = {"total": 0, "sames": 0}
+            pending.add(ex.submit(scanDirectory, directory, extensions))
+        for data in files:
+          dirs[data["path"].parent]["total"] += 1
+          yield data
+
+
 def getFiles(path, isRecurse, extensions=None):
-  if isinstance(path, str):
-    path = pathlib.Path(path)
-  files = deque(path.iterdir())
-  dirs = {path: {"total": 0, "sames": 0}}
-  result = []
-  while len(files) > 0:
-    file = files.popleft()
-    if file.is_file() and (extensions is None or file.suffix in extensions):
-      result.append({"path": file.absolute()})
-      dirs[file.parent]["total"] += 1
-    elif file.is_dir() and isRecurse:
-      files.extend(file.iterdir())
-      dirs[file] = {"total": 0, "sames": 0}
+  dirs = {}
+  result = list(iterFiles(path, isRecurse, extensions, dirs))
   result.sort(key=lambda x: x["path"])
   return result, dirs
 
 
+def getImageShape(path):
+  with Image.open(path) as image:
+    width, height = image.size
+    orientation = image.getexif().get(0x0112, 1)
+  if orientation in [5, 6, 7, 8]:  # 90度回転
+    width, height = height, width
+  return (height, width, 3)
+
+
+# JPEGはDCTの段階で縮小して読む。shapeはヘッダーから取る
+def readReducedImage(path, minSize=64):
+  if path.suffix.lower() in [".jpg", ".jpeg"]:
+    try:
+      shape = getImageShape(path)
+    except OSError:
+      shape = None
+    for scale, flag in REDUCED_FLAGS if shape is not None else []:
+      if min(shape[:2]) // scale >= minSize:
+        image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), flag)
+        if image is not None:
+          return image, shape
+        break
+  image = IU.readImage(path)
+  return image, None if image is None else image.shape
+
+
+# float16で保持した記述子はBFMatcherに渡す前にfloat32に戻す
+def toMatchable(descriptors):
+  return descriptors.astype(np.float32) if descriptors.dtype == np.float16 else descriptors
+
+
 def isSameImage(target, other, threshold, phObj=None, matcher=None, diffRatio=0.2):
   if phObj is not None:
     diff = IU.comparePHash(target["pHash"], other["pHash"], phObj)
   else:
-    diff = IU.compareDescriptor(matcher, target["descriptors"], other["descriptors"])
+    diff = IU.compareDescriptor(matcher, toMatchable(target["descriptors"]), toMatchable(other["descriptors"]))
 
   if diff <= threshold and abs(IU.getRatio(target["shape"]) - IU.getRatio(other["shape"])) <= diffRatio:
     return True, diff
   return False, diff
 
 
+def packPHashes(lt):
+  if len(lt) == 0:
+    return np.empty(0, dtype=np.uint64)
+  hashes = np.ascontiguousarray(np.vstack([x["pHash"] for x in lt]), dtype=np.uint8)
+  return hashes.view(np.uint64).ravel()
+
+
+# 2次元と3次元のshapeを1つの配列に入れられるように、3要素に揃えて-1で埋める
+def packShapes(lt):
+  shapes = np.full((len(lt), 3), -1, dtype=np.int32)
+  for i, x in enumerate(lt):
+    shape = tuple(x["shape"])[:3]
+    shapes[i, : len(shape)] = shape
+  return shapes
+
+
+def unpackShape(row):
+  return tuple(x for x in row.tolist() if x >= 0)
+
+
+def getRatios(lt):
+  return np.fromiter((IU.getRatio(x["shape"]) for x in lt), dtype=np.float64, count=len(lt))
+
+
+# アスペクト比でソートしておき、比の差がdiffRatio以内の範囲だけを二分探索で取り出す
+# 境界は浮動小数の誤差分だけ広めに探し、isSameImageと同じ式で絞り直す
+class RatioIndex:
+  def __init__(self, ratios, diffRatio=0.2):
+    self.order = np.argsort(ratios, kind="stable")
+    self.ratios = ratios[self.order]
+    self.diffRatio = diffRatio
+    self.countPair = 0
+    self.countPruned = 0
+
+  # 範囲内の添字を元の順で返す。maskがFalseの要素は候補にも枝刈り数にも数えない
+  def query(self, ratio, mask=None):
+    start = np.searchsorted(self.ratios, ratio - self.diffRatio - 1e-9, side="left")
+    stop = np.searchsorted(self.ratios, ratio + self.diffRatio + 1e-9, side="right")
+    indices = self.order[start:stop][np.abs(self.ratios[start:stop] - ratio) <= self.diffRatio]
+    total = len(self.ratios)
+    if mask is not None:
+      indices = indices[mask[indices]]
+      total = int(np.count_nonzero(mask))
+    self.countPair += total
+    self.countPruned += total - len(indices)
+    return np.sort(indices)
+
+  def getPruningRate(self):
+    return self.countPruned / self.countPair if self.countPair > 0 else 0.0
+
+
+def countBits(x):
+  if hasattr(np, "bitwise_count"):
+    return np.bitwise_count(x)
+  x = np.ascontiguousarray(x)
+  return np.unpackbits(x.view(np.uint8).reshape(*x.shape, x.itemsize), axis=-1).sum(axis=-1, dtype=np.uint8)
+
+
+def hammingDistances(x, hashes):
+  return countBits(np.bitwise_xor(x, hashes))
+
+
+# x, ratioに列ベクトル(m, 1)を渡せばブロック同士(m, n)で比較できる
+def getSameMask(x, ratio, hashes, ratios, threshold, diffRatio=0.2):
+  diffs = hammingDistances(x, hashes)
+  mask = (diffs <= threshold) & (np.abs(ratios - ratio) <= diffRatio)
+  return mask, diffs
+
+
 def factor(x):
   if x == 1:
     return [1]